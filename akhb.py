@@ -2,7 +2,9 @@
 Scrape AkibaHobby
 """
 
+import os
 import asyncio
+import signal
 import aiofiles
 import aiohttp
 import json
@@ -11,40 +13,108 @@ import logging
 from pathlib import Path
 from aiohttp import ClientResponse
 from bs4 import BeautifulSoup, NavigableString
+from decimal import Decimal, InvalidOperation
 from functools import partial
 from lib.dcs_skip import KahSkipManager
+from lib.dcs_url import KahUrlCanonicalizer, KahUrlRule
+from lib.dcs_store import KahContentStore
+from lib.dcs_shard import KahShardedDir
+from lib.dcs_imgproc import KahImageIndex, KahImageProcessor
 from typing import Optional
 
-from lib.dcs_lib import KahLogger, try_find_all_else_empty_get_dict, try_find_all_else_empty_get_text, try_find_else_none, decode_if_possible, callback_image_save, redirect_url
-from lib.kahscrape.kahscrape import KahRatelimitedFetcher, FetcherABC
+from lib.dcs_lib import KahLogger, try_find_all_else_empty_get_dict, try_find_all_else_empty_get_text, try_find_else_none, callback_image_save, redirect_url
+from lib.dcs_fetch import KahAdaptiveFetcher, KahHostLimits, KahDeadLetterLog
+from lib.dcs_frontier import KahFrontier
+from lib.dcs_sched import KahPriorityScheduler, KahPriorityClass
+from lib.dcs_httpcache import KahHttpCache, REVALIDATE_REPLAY, REVALIDATE_SKIP
+from lib.dcs_http import get_pool, close_pools
+from lib.dcs_json import KahJsonParser, json_callback
+from lib.dcs_charset import preview
+from lib.dcs_updated import KahUpdatedIndex
+from lib.dcs_paginate import KahPaginator
+from lib.dcs_metrics import KahMetrics, KahMetricsExporter
+from lib.kahscrape.kahscrape import FetcherABC
 
 # ==================================================================
 #  General setup
 # ==================================================================
 SHOULD_SKIP_NON_INDIE = True # if True, skip non-indies (インディーズ) items
+SHOULD_DEDUPE_IMAGES = True # if True, identical images are stored once (hardlinked, see KahContentStore)
+SHOULD_RECRAWL_ITEMS = False # if True, already downloaded items are re-fetched conditionally (saved again only if changed)
+SHOULD_USE_BULK_PRODUCTS = False # if True, discover and ingest items through the paginated products.json (250 items per request)
+SHOULD_CRAWL_INCREMENTALLY = False # if True, (re-)fetch only items whose updated_at changed since their last ingestion
+SHOULD_PROCESS_IMAGES = False # if True, saved images get thumbnails and pHash/dHash in worker processes (needs Pillow, see KahImageProcessor)
 
 NAME: str = "akbh"
 PATH_CURRENT = Path(__file__).parent
 PATH_RESOURCES = PATH_CURRENT / "Resources"
 PATH_OUTPUT = PATH_RESOURCES / NAME
 PATH_LOG = PATH_OUTPUT / "logger.log"
-PATH_DOWNLOADED_INDEX = PATH_OUTPUT / "downloaded_index.txt"
+PATH_DOWNLOADED_INDEX = PATH_OUTPUT / "downloaded_index.txt" # legacy text index, imported into the backend below
+SKIP_INDEX_BACKEND = "sqlite" # "sqlite" (downloaded_index.sqlite3, shared with other crawler processes), "segmented" (downloaded_index/, single process), "fingerprint" or "memory"
+PATH_DEAD_LETTERS = PATH_OUTPUT / "dead_letters.jsonl" # urls that kept failing, re-fed on next run
+PATH_FRONTIER = PATH_OUTPUT / "frontier.sqlite3" # queued urls, to resume an interrupted crawl
+PATH_HTTP_CACHE = PATH_OUTPUT / "http_cache.sqlite3" # ETag/Last-Modified of fetched pages, for conditional re-crawls
+PATH_ITEM_UPDATES = PATH_OUTPUT / "item_updates.sqlite3" # last ingested updated_at per item handle, for incremental crawls
+PATH_METRICS = PATH_OUTPUT / "metrics.json" # crawl metrics snapshot, rewritten every 10s
+PATH_IMAGE_INDEX = PATH_OUTPUT / "image_index.sqlite3" # size and perceptual hashes of processed images
+PATH_THUMBNAILS = PATH_OUTPUT / "thumbnails" # <size>/<ab>/<sha256>.jpg
+METRICS_PORT: Optional[int] = int(os.environ.get("AKHB_METRICS_PORT", 9108)) # Prometheus text on http://127.0.0.1:<port>/metrics (None: no endpoint, 0: any free port)
 
-PATH_ITEM_JSON = PATH_OUTPUT / "json"
+PATH_ITEM_JSON = PATH_OUTPUT / "json" # sharded, see KahShardedDir (flat trees: python migrate_shards.py <dir>)
 PATH_ITEM_JSON.mkdir(parents=True, exist_ok=True)
-PATH_ITEM_IMAGES = PATH_OUTPUT / "images"
+PATH_ITEM_IMAGES = PATH_OUTPUT / "images" # sharded, see KahShardedDir
 PATH_ITEM_IMAGES.mkdir(parents=True, exist_ok=True)
 
-LOGGER = KahLogger(NAME, PATH_LOG, logging.DEBUG, logging.INFO)
-skipper = KahSkipManager(PATH_DOWNLOADED_INDEX, logger=LOGGER)
+SHOPIFY_TRACKING_PARAMS = ("v", "_pos", "_sid", "_ss", "_psq", "_fid", "variant") # cache-busting / search tracking
+CANONICALIZER = KahUrlCanonicalizer(rules={
+    "cdn.shopify.com": KahUrlRule(query_deny=SHOPIFY_TRACKING_PARAMS),
+    "shop.akbh.jp": KahUrlRule(query_deny=SHOPIFY_TRACKING_PARAMS),
+})
+
+LOGGER = KahLogger(NAME, PATH_LOG, logging.DEBUG, logging.INFO, queued=True) # file and console writes off the event loop
+skipper = KahSkipManager(PATH_DOWNLOADED_INDEX, logger=LOGGER, backend=SKIP_INDEX_BACKEND, canonicalizer=CANONICALIZER)
+store = KahContentStore(PATH_OUTPUT, logger=LOGGER) if SHOULD_DEDUPE_IMAGES else None
+item_jsons = KahShardedDir(PATH_ITEM_JSON, logger=LOGGER)
+item_images = KahShardedDir(PATH_ITEM_IMAGES, logger=LOGGER)
+image_processor = KahImageProcessor(KahImageIndex(PATH_IMAGE_INDEX, logger=LOGGER), PATH_THUMBNAILS, logger=LOGGER) if SHOULD_PROCESS_IMAGES else None
+dead_letters = KahDeadLetterLog(PATH_DEAD_LETTERS, logger=LOGGER)
+frontier = KahFrontier(PATH_FRONTIER, logger=LOGGER)
+http_cache = KahHttpCache(PATH_HTTP_CACHE, logger=LOGGER)
+json_parser = KahJsonParser(logger=LOGGER) # json bodies are parsed before callbacks, large ones off the event loop
+item_updates = KahUpdatedIndex(PATH_ITEM_UPDATES, logger=LOGGER)
+metrics = KahMetrics()
+metrics.gauge("skip_index_lookups", lambda: skipper.lookups)
+metrics.gauge("skip_index_hit_ratio", lambda: skipper.hits / skipper.lookups if skipper.lookups else 0.0)
+if image_processor:
+    metrics.gauge("image_processing_queued", lambda: image_processor.queued)
+    metrics.gauge("image_processing_dropped", lambda: image_processor.dropped)
 
 # ==================================================================
 #  Utilities
 # ==================================================================
 
-async def get_fetcher() -> KahRatelimitedFetcher:
-    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10.0))
-    return KahRatelimitedFetcher(session=session, logger=LOGGER, cc_min_wait_time=0.25)
+HOST_LIMITS = { # per-host AIMD concurrency bounds
+    "shop.akbh.jp": KahHostLimits(min_concurrency=1, max_concurrency=4, min_wait_time=0.25), # item/search json
+    "cdn.shopify.com": KahHostLimits(min_concurrency=2, max_concurrency=16, initial_concurrency=4), # images
+}
+
+PRIORITY_CLASSES = [ # discovery > item metadata > images; bounded queues keep memory flat on large catalogs
+    KahPriorityClass("discovery", weight=8.0, max_queued=64),
+    KahPriorityClass("metadata", weight=4.0, max_queued=256),
+    KahPriorityClass("images", weight=1.0, max_queued=4096),
+]
+
+DEFAULT_HOST_LIMITS = KahHostLimits(min_wait_time=0.25)
+HTTP_POOL = get_pool(host_limits=[*HOST_LIMITS.values(), DEFAULT_HOST_LIMITS], logger=LOGGER, # shared by all crawlers of the process
+                     timeout=aiohttp.ClientTimeout(total=None, sock_connect=10.0, sock_read=10.0)) # no total: images are streamed
+
+async def get_fetcher() -> KahAdaptiveFetcher:
+    session = HTTP_POOL.session()
+    scheduler = KahPriorityScheduler(PRIORITY_CLASSES, max_running=32, logger=LOGGER)
+    return KahAdaptiveFetcher(session=session, logger=LOGGER, host_limits=HOST_LIMITS,
+                              default_limits=DEFAULT_HOST_LIMITS, dead_letters=dead_letters, frontier=frontier,
+                              scheduler=scheduler, http_cache=http_cache, close_session=False, metrics=metrics)
 
 def absolute_url_if(url: Optional[str], base: str) -> Optional[str]:
     if url and url.startswith("/"):
@@ -67,58 +137,100 @@ async def onerr(
         resp: ClientResponse | None = None, 
         data: bytes | None = None
     ):
-    LOGGER.warning(f"Error occurred while fetching {url}\n\tdata={f'{decode_if_possible(data)[:40]}...' if data else None}:\n\t{e=}")
+    LOGGER.warning(f"Error occurred while fetching {url}\n\tdata={f'{preview(data, resp=resp)}...' if data else None}:\n\t{e=}")
     return
 
 # //////////////////////////////////////////////////////////////
-#  Item page (json)
+#  Images
 # //////////////////////////////////////////////////////////////
-async def onreq_item_page(fetcher: FetcherABC, resp: ClientResponse, data: bytes, item_handle: Optional[str] = None):
-    """Item page."""
-    LOGGER.info(f"Successfully fetched {resp.url}:\n\t{decode_if_possible(data)[:40]}...")
-    skipper.mark_url_as_downloaded(str(resp.url))
-    
-    # save json
-    save_file_path = PATH_ITEM_JSON / f"{item_handle}.json"
-    async with aiofiles.open(save_file_path, "wb+") as f:
-        await f.write(data)
+def get_image_callback(img_url: str) -> Optional[partial]:
+    """Callback saving the image at img_url, None if its name cannot be parsed."""
+    image_name = re.search(r"/([^/\?]*?)(?:\?v=\d+)?$", img_url)
+    if not image_name:
+        LOGGER.critical(f"Cannot parse image name from URL: {img_url}")
+        return None
+    image_name = image_name.group(1)
+    print(f"image_name: {image_name}")
+    return partial(callback_image_save, shards=item_images, save_name=image_name, skipper=skipper, logger=LOGGER, store=store, processor=image_processor)
 
-    # parse for images
-    content = json.loads(decode_if_possible(data))
+# //////////////////////////////////////////////////////////////
+#  Items
+# //////////////////////////////////////////////////////////////
+def item_url_of(item_handle: str) -> str:
+    return skipper.canonicalize(f"https://shop.akbh.jp/products/{item_handle}.js")
 
-    if "images" not in content or not isinstance(content["images"], list):
-        LOGGER.critical(f"No images found in item {item_handle}: {content}")
-        return
-    
-    image_urls = [re.sub(r"^//", "https://", img_url) for img_url in content["images"] if isinstance(img_url, str)]
-    for img_url in image_urls:
-        ret = skipper.should_skip_url(img_url)
+def should_skip_items(item_handles: dict[str, str], updated_ats: Optional[dict[str, Optional[str]]] = None) -> dict[str, str | None]:
+    """Skip reason (or None) of each canonical item url (-> handle).
+    Incrementally, items with an updated_at (item url -> updated_at) are skipped only if unchanged since their last ingestion."""
+    if SHOULD_CRAWL_INCREMENTALLY and updated_ats:
+        dated = {item_url: updated_ats[item_url] for item_url in item_handles if updated_ats.get(item_url)}
+        unchanged = item_updates.unchanged({item_handles[item_url]: updated_at for item_url, updated_at in dated.items()})
+        reasons = {item_url: "Unchanged since last crawl." if item_handles[item_url] in unchanged else skipper.rules.match(item_url)
+                   for item_url in dated}
+        undated = [item_url for item_url in item_handles if item_url not in dated]
+        if undated:
+            reasons.update(should_skip_items({item_url: item_handles[item_url] for item_url in undated}))
+        return {item_url: reasons[item_url] for item_url in item_handles}
+    if SHOULD_RECRAWL_ITEMS: # only skip blacklisted items, downloaded ones are revalidated
+        return {item_url: skipper.rules.match(item_url) for item_url in item_handles}
+    return skipper.should_skip_urls(item_handles)
+
+async def ingest_item(fetcher: FetcherABC, item_url: str, item_handle: str, data: bytes, image_urls: list[str], updated_at: Optional[str] = None):
+    """Save item json, mark it as downloaded (with its updated_at, if known) and queue its images."""
+    skipper.mark_url_as_downloaded(item_url)
+
+    # save json
+    writer = item_jsons.new_writer(f"{item_handle}.json")
+    try:
+        async with aiofiles.open(writer.tmp_path, "wb") as f:
+            await f.write(data)
+    except BaseException:
+        writer.discard()
+        raise
+    writer.update(data)
+    item_jsons.commit(writer, f"{item_handle}.json")
+    if updated_at:
+        item_updates.mark(item_handle, updated_at)
+
+    image_urls = [re.sub(r"^//", "https://", img_url) for img_url in image_urls if isinstance(img_url, str)]
+    for img_url, ret in skipper.should_skip_urls(image_urls).items(): # canonical urls
         if ret is not None:
             LOGGER.info(f"Skipping fetching {img_url}: {ret}")
             continue
 
-        image_name = re.search(r"/([^/\?]*?)(?:\?v=\d+)?$", img_url)
-        if not image_name:
-            LOGGER.critical(f"Cannot parse image name from URL: {img_url}")
-            continue
-        image_name = image_name.group(1)
-        print(f"image_name: {image_name}")
+        await queue(fetcher, "image", img_url)
 
-        await fetcher.fetch(
-            img_url,
-            partial(callback_image_save, save_file_path=PATH_ITEM_IMAGES / f"{image_name}", skipper=skipper, logger=LOGGER),
-            onerr
-        )
+# //////////////////////////////////////////////////////////////
+#  Item page (json)
+# //////////////////////////////////////////////////////////////
+async def onreq_item_page(fetcher: FetcherABC, resp: ClientResponse, data: bytes, content: dict, item_url: Optional[str] = None, item_handle: Optional[str] = None, updated_at: Optional[str] = None):
+    """Item page (item_url: canonical url requested, resp.url being percent-encoded by aiohttp)."""
+    LOGGER.info(f"Successfully fetched {resp.url}:\n\t{preview(data, resp=resp)}...")
+
+    # parse for images
+    image_urls = content.get("images")
+
+    if not isinstance(image_urls, list):
+        LOGGER.critical(f"No images found in item {item_handle}: {content}")
+        image_urls = []
+
+    await ingest_item(fetcher, item_url or skipper.canonicalize(str(resp.url)), item_handle, data, image_urls, updated_at or content.get("updated_at"))
 
 # //////////////////////////////////////////////////////////////
 #  Search page (json)
 # //////////////////////////////////////////////////////////////
-async def onreq_search_page(fetcher: FetcherABC, resp: ClientResponse, data: bytes):
+def search_page_url(page: int) -> str:
+    return CANONICALIZER(f"https://shop.akbh.jp/collections/all-products?view=lsa&sort_by=&page={page}")
+
+async def onreq_search_page(fetcher: FetcherABC, resp: ClientResponse, data: bytes, json_data: list, page: Optional[int] = None):
     """Search page."""
-    LOGGER.info(f"Successfully fetched {resp.url}:\n\t{decode_if_possible(data)[:40]}...")
+    LOGGER.info(f"Successfully fetched {resp.url}:\n\t{preview(data, resp=resp)}...")
     skipper.mark_url_as_downloaded(str(resp.url))
+    if page is not None and not await get_paginator(fetcher, "search").page_done(page, [str(item.get("handle")) for item in json_data]):
+        return # past the last page
 
-    json_data = json.loads(decode_if_possible(data))
+    item_handles: dict[str, str] = {} # item url -> handle
+    updated_ats: dict[str, Optional[str]] = {} # item url -> updated_at
     for item in json_data:
         if SHOULD_SKIP_NON_INDIE and item.get("type") != "インディーズ":
             LOGGER.info(f"Skipping non-indie (インディーズ) item: {item.get('title')} ({item.get('type')})")
@@ -129,18 +241,164 @@ async def onreq_search_page(fetcher: FetcherABC, resp: ClientResponse, data: byt
             LOGGER.critical(f"Cannot find product handle in item: {item}")
             continue
 
-        item_url = f"https://shop.akbh.jp/products/{item_handle}.js"
+        item_url = item_url_of(item_handle)
+        item_handles[item_url] = item_handle
+        updated_ats[item_url] = item.get("updated_at")
 
-        ret = skipper.should_skip_url(item_url) # Skip if already downloaded
+    for item_url, ret in should_skip_items(item_handles, updated_ats).items(): # Skip if already downloaded (or unchanged)
         if ret is not None:
             LOGGER.info(f"Skipping fetching {item_url}: {ret}")
             continue
 
-        await fetcher.fetch( # Queue item
-            item_url,
-            partial(onreq_item_page, item_handle=item_handle),
-            onerr
-        )
+        await queue(fetcher, "item", item_url, item_handle=item_handles[item_url], updated_at=updated_ats[item_url]) # Queue item
+
+# //////////////////////////////////////////////////////////////
+#  Bulk products page (json)
+# //////////////////////////////////////////////////////////////
+BULK_PRODUCTS_LIMIT = 250 # Shopify maximum page size
+
+def bulk_products_url(page: int) -> str:
+    return CANONICALIZER(f"https://shop.akbh.jp/collections/all-products/products.json?limit={BULK_PRODUCTS_LIMIT}&page={page}")
+
+def cents_of(price: Optional[str]) -> Optional[int]:
+    """products.json price ("12.50") -> .js price (1250)."""
+    try:
+        return None if price is None else int(Decimal(price) * 100)
+    except (InvalidOperation, TypeError):
+        return None
+
+def js_product_of(product: dict) -> dict:
+    """products.json product -> /products/<handle>.js product, the schema of item jsons (e.g. "type", images as urls,
+    prices in cents)."""
+    variants = []
+    for variant in product.get("variants") or []:
+        options = [variant.get(f"option{i}") for i in (1, 2, 3) if variant.get(f"option{i}") is not None]
+        public_title = None if variant.get("title") == "Default Title" else variant.get("title")
+        variants.append({
+            "id": variant.get("id"),
+            "title": variant.get("title"),
+            "option1": variant.get("option1"),
+            "option2": variant.get("option2"),
+            "option3": variant.get("option3"),
+            "sku": variant.get("sku"),
+            "requires_shipping": variant.get("requires_shipping"),
+            "taxable": variant.get("taxable"),
+            "featured_image": variant.get("featured_image"),
+            "available": variant.get("available"),
+            "name": f"{product.get('title')} - {public_title}" if public_title else product.get("title"),
+            "public_title": public_title,
+            "options": options,
+            "price": cents_of(variant.get("price")),
+            "weight": variant.get("grams"),
+            "compare_at_price": cents_of(variant.get("compare_at_price")),
+        })
+    prices = [v["price"] for v in variants if v["price"] is not None]
+    compare_prices = [v["compare_at_price"] for v in variants if v["compare_at_price"] is not None]
+    images = [image.get("src") for image in product.get("images") or [] if isinstance(image, dict) and image.get("src")]
+    return {
+        "id": product.get("id"),
+        "title": product.get("title"),
+        "handle": product.get("handle"),
+        "description": product.get("body_html"),
+        "published_at": product.get("published_at"),
+        "created_at": product.get("created_at"),
+        "vendor": product.get("vendor"),
+        "type": product.get("product_type"),
+        "tags": product.get("tags"),
+        "price": min(prices, default=None),
+        "price_min": min(prices, default=None),
+        "price_max": max(prices, default=None),
+        "available": any(v["available"] for v in variants),
+        "price_varies": len(set(prices)) > 1,
+        "compare_at_price": min(compare_prices, default=None),
+        "compare_at_price_min": min(compare_prices, default=0),
+        "compare_at_price_max": max(compare_prices, default=0),
+        "compare_at_price_varies": len(set(compare_prices)) > 1,
+        "variants": variants,
+        "images": images,
+        "featured_image": images[0] if images else None,
+        "options": product.get("options"),
+        "url": f"/products/{product.get('handle')}",
+    }
+
+async def onreq_bulk_products_page(fetcher: FetcherABC, resp: ClientResponse, data: bytes, content: dict, page: int = 1):
+    """Bulk products page: full product objects (images included), so items need no request of their own.
+    Each product is saved as its item json, mapped to the /products/<handle>.js schema (see js_product_of)."""
+    LOGGER.info(f"Successfully fetched {resp.url}:\n\t{preview(data, resp=resp)}...")
+    skipper.mark_url_as_downloaded(str(resp.url))
+
+    products = content.get("products", [])
+    if not await get_paginator(fetcher, "bulk").page_done(page, [str(product.get("id")) for product in products],
+                                                          is_last=len(products) < BULK_PRODUCTS_LIMIT):
+        return # past the last page
+
+    item_products: dict[str, dict] = {} # item url -> product
+    for product in products:
+        if SHOULD_SKIP_NON_INDIE and product.get("product_type") != "インディーズ":
+            LOGGER.info(f"Skipping non-indie (インディーズ) item: {product.get('title')} ({product.get('product_type')})")
+            continue
+
+        item_handle = product.get("handle") # Unique identifier
+        if not item_handle:
+            LOGGER.critical(f"Cannot find product handle in item: {product.get('id')}")
+            continue
+
+        item_products[item_url_of(item_handle)] = product
+
+    item_handles = {item_url: product["handle"] for item_url, product in item_products.items()}
+    updated_ats = {item_url: product.get("updated_at") for item_url, product in item_products.items()} # not in the .js schema
+    for item_url, ret in should_skip_items(item_handles, updated_ats).items(): # Skip if already downloaded (or unchanged)
+        if ret is not None:
+            LOGGER.info(f"Skipping {item_url}: {ret}")
+            continue
+
+        product = js_product_of(item_products[item_url])
+        await ingest_item(fetcher, item_url, product["handle"], json.dumps(product, ensure_ascii=False).encode("utf-8"), product["images"],
+                          updated_ats[item_url])
+
+# //////////////////////////////////////////////////////////////
+#  Queueing
+# //////////////////////////////////////////////////////////////
+KINDS = { # kind -> (url, **args) -> callback; kinds and args are persisted in the frontier and dead letters
+    "search": lambda url, page=None: partial(json_callback(onreq_search_page, json_parser), page=page),
+    "bulk": lambda url, page: partial(json_callback(onreq_bulk_products_page, json_parser), page=page),
+    "item": lambda url, item_handle, updated_at=None: partial(json_callback(onreq_item_page, json_parser), item_url=url, item_handle=item_handle, updated_at=updated_at),
+    "image": get_image_callback,
+}
+KIND_PRIORITIES = {"search": "discovery", "bulk": "discovery", "item": "metadata", "image": "images"} # kind -> priority class
+KIND_REVALIDATE = {"search": REVALIDATE_REPLAY, "bulk": REVALIDATE_REPLAY, "item": REVALIDATE_SKIP} # kind -> conditional request mode, see KahHttpCache
+STREAMED_KINDS = {"image"} # callbacks reading the body in chunks, see KahAdaptiveFetcher
+
+async def queue(fetcher: FetcherABC, kind: str, url: str, **args) -> Optional[asyncio.Task]:
+    """Queue url with the callback and priority class of given kind (waits while that class queue is full)."""
+    callback = KINDS[kind](url, **args)
+    if callback is None:
+        return None
+    revalidate = KIND_REVALIDATE.get(kind)
+    if revalidate == REVALIDATE_SKIP and SHOULD_CRAWL_INCREMENTALLY and args.get("updated_at"):
+        revalidate = None # updated_at changed: an unchanged body must still be ingested, to record it
+    return await fetcher.fetch(url, callback, onerr, kind=kind, args=args, priority=KIND_PRIORITIES[kind], revalidate=revalidate,
+                        stream=kind in STREAMED_KINDS)
+
+PAGE_WINDOW = 4 # listing pages fetched speculatively ahead, see KahPaginator
+PAGINATED_KINDS = {"search": search_page_url, "bulk": bulk_products_url} # kind -> page url
+paginators: dict[str, KahPaginator] = {} # kind -> paginator of the running crawl
+
+def get_paginator(fetcher: FetcherABC, kind: str) -> KahPaginator:
+    if kind not in paginators:
+        page_url = PAGINATED_KINDS[kind]
+        paginators[kind] = KahPaginator(lambda page: queue(fetcher, kind, page_url(page), page=page),
+                                        window=PAGE_WINDOW, name=f"{kind} pages", logger=LOGGER)
+    return paginators[kind]
+
+async def refeed_dead_letters(fetcher: FetcherABC):
+    """Queue again the urls that kept failing during previous runs."""
+    for record in dead_letters.drain():
+        url, kind = record["url"], record.get("kind")
+        if kind not in KINDS or kind in ("search", "bulk") or skipper.should_skip_url(url) is not None: # search pages are fetched anyway
+            continue
+        LOGGER.info(f"Re-feeding {url} (failed {record.get('attempts')} times: {record.get('error')})")
+        await queue(fetcher, kind, url, **record.get("args", {}))
 
 # ==================================================================
 #  Main
@@ -149,18 +407,40 @@ if __name__ == '__main__':
         
     async def main():
         fetcher = await get_fetcher()
+        exporter = KahMetricsExporter(metrics, port=METRICS_PORT, path_snapshot=PATH_METRICS, logger=LOGGER)
+        await exporter.start()
+        loop = asyncio.get_running_loop()
+        try: # on SIGINT, drain in-flight requests and checkpoint the frontier
+            loop.add_signal_handler(signal.SIGINT, fetcher.stop)
+        except NotImplementedError: # Windows
+            signal.signal(signal.SIGINT, lambda *_: loop.call_soon_threadsafe(fetcher.stop))
 
-        # === Search pages ===
-        urls = (f"https://shop.akbh.jp/collections/all-products?view=lsa&sort_by=&page={page}"
-            for page in range(0, 32 + 1))
-        for url in urls:
-            await fetcher.fetch(
-                url,
-                onreq_search_page,
-                onerr
-            )
+        if frontier.begin_session(): # === Resume interrupted crawl ===
+            for url, kind, args in frontier.pending():
+                task = await queue(fetcher, kind, url, **args)
+                if kind in PAGINATED_KINDS and args.get("page") is not None: # resume walking the pages from there
+                    get_paginator(fetcher, kind).track(args["page"], task)
+        elif SHOULD_USE_BULK_PRODUCTS: # === Bulk products pages, until a short page ===
+            await get_paginator(fetcher, "bulk").start()
+        else: # === Search pages, until an empty one ===
+            await get_paginator(fetcher, "search").start()
+        await refeed_dead_letters(fetcher)
         
         await fetcher.wait_and_close()
+        if image_processor:
+            if not fetcher.stopping: # images dropped while the stage was saturated
+                item_images.checkpoint()
+                await image_processor.catch_up((item_images.absolute(entry), entry.name, entry.digest) for entry in item_images.entries())
+            await image_processor.wait_and_close()
+            image_processor.index.close()
+        await exporter.stop()
+        await close_pools()
+        json_parser.close()
+        item_updates.close()
+        item_jsons.close()
+        item_images.close()
+        frontier.close()
+        http_cache.close()
+        # LOGGER is closed at exit, after the skip manager and the other atexit closes that may still log
 
     asyncio.run(main())
-
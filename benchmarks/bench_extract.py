@@ -0,0 +1,102 @@
+"""
+Benchmark per-page parse + extract cost: BeautifulSoup find/select helpers vs compiled lxml field specs
+
+Pages are synthetic Akibaoo-like product pages (navigation, detail tables, thumbnails), extracted with the fields
+of the former BeautifulSoup AkibaooSoupParser plus the dcs_lib try_find helpers, and with the equivalent KahExtractor
+spec (as old/dcs/post_process/akibaoo_post_process.py AkibaooPageParser).
+Usage: python -m benchmarks.bench_extract [pages] [items_per_page]   (default: 200 40)
+Needs beautifulsoup4, lxml and cssselect.
+"""
+import sys
+import time
+from bs4 import BeautifulSoup
+from lib.dcs_lib import try_find_else_none, try_find_all_else_empty_get_text, try_find_all_else_empty_get_dict
+from lib.dcs_extract import KahExtractor, KahField, parse_html, text_of
+
+SITE_SUFFIX = " | あきばお～こく"
+
+def make_page(i: int, items: int) -> bytes:
+    nav = "".join(f'<li class="nav_item"><a href="/category/{c}/">カテゴリ {c}</a></li>' for c in range(items))
+    details = "".join(f'<div class="spec_row"><span class="spec_label">項目 {d}</span><span class="spec_value">値 {d} です</span></div>'
+                      for d in range(items // 4))
+    dl = "".join(f"<dt>ラベル {d}</dt><dd>説明 {d}</dd>" for d in range(items // 4))
+    thumbs = "".join(f'<li><img class="goodsDtlImgThumb" src="/img/goods/{i}_{t}.jpg" alt="thumb {t}"></li>' for t in range(8))
+    related = "".join(f'<div class="related"><a href="/goods/{i + r}/"><img src="/img/s/{i + r}.jpg"><p>関連商品 {r}</p></a></div>'
+                      for r in range(items))
+    return f"""<!DOCTYPE html><html lang="ja"><head><meta charset="utf-8">
+<title>商品 {i} フィギュア{SITE_SUFFIX}</title><link rel="canonical" href="/goods/detail/{i}/">
+<link rel="stylesheet" href="/css/style.css"><script>var dataLayer = [];</script></head>
+<body><header><ul class="nav">{nav}</ul></header><main><h1>商品 {i} フィギュア</h1>
+<div class="area_Detail">{details}<p class="note">※ 予約商品です</p></div>
+<div id="goodsDetail_info" class="goodsDetail_info cf"><p class="detail_info">発売日 2024/01/01</p><dl>{dl}</dl></div>
+<ul class="thumbs">{thumbs}</ul><section>{related}</section></main><footer><p>&copy; akibaoo</p></footer></body></html>""".encode("utf-8")
+
+def area_details(elements) -> dict[str, str]:
+    """Texts of the classed elements of div.area_Detail, grouped by class (as AkibaooPageParser)."""
+    out: dict[str, list[str]] = {}
+    for class_name, text in elements:
+        if text:
+            out.setdefault(class_name, []).append(text)
+    return {k: "\n".join(v) for k, v in out.items()}
+
+def extract_soup(data: bytes, features: str) -> dict:
+    soup = BeautifulSoup(data, features=features)
+    link = soup.select_one('link[rel="canonical"]')
+    title = soup.select_one("title")
+    area = soup.select_one("div.area_Detail")
+    info = soup.select_one("div#goodsDetail_info.goodsDetail_info.cf")
+    return {
+        "canonical": link["href"] if link else None,
+        "name": title.text.replace(SITE_SUFFIX, "").strip(" \n") if title else None,
+        "area_details": area_details((" ".join(e["class"]), e.get_text(strip=True)) for e in area.find_all(True) if e.has_attr("class")) if area else None,
+        "info_details": str(info) if info else None,
+        "image_urls": [img["src"] for img in soup.select("img.goodsDtlImgThumb")],
+        "heading": try_find_else_none(soup, "h1"),
+        "labels": try_find_all_else_empty_get_text(soup, "dt"),
+        "links": try_find_all_else_empty_get_dict(soup, "a"),
+    }
+
+AKIBAOO_FIELDS = {
+    "canonical": KahField('link[rel="canonical"]', "@href"),
+    "name": KahField("title", transform=lambda t: t.replace(SITE_SUFFIX, "")),
+    "area_details": KahField("div.area_Detail [class]", "element", many=True),
+    "info_details": KahField("div#goodsDetail_info.goodsDetail_info.cf", "html"),
+    "image_urls": KahField("img.goodsDtlImgThumb", "@src", many=True),
+    "heading": KahField("h1"),
+    "labels": KahField("//dt", many=True, xpath=True),
+    "links": KahField("a", "attrs", many=True),
+}
+
+def extract_lxml(extractor: KahExtractor, data: bytes) -> dict:
+    fields = extractor.extract(parse_html(data))
+    fields["area_details"] = area_details((e.get("class"), text_of(e)) for e in fields["area_details"])
+    return fields
+
+def bench(name: str, extract, pages: list[bytes]) -> tuple[float, dict]:
+    t0 = time.perf_counter()
+    for data in pages:
+        result = extract(data)
+    elapsed = time.perf_counter() - t0
+    print(f"{name:<28}: {1e3 * elapsed / len(pages):7.3f} ms/page")
+    return elapsed, result
+
+def main(n: int, items: int) -> None:
+    pages = [make_page(i, items) for i in range(n)]
+    print(f"{n} pages of {sum(map(len, pages)) / n / 1024:.0f} KB, {items} items per list")
+    t_soup, soup_fields = bench("bs4 html.parser + helpers", lambda d: extract_soup(d, "html.parser"), pages)
+    bench("bs4 lxml + helpers", lambda d: extract_soup(d, "lxml"), pages)
+    extractor = KahExtractor(AKIBAOO_FIELDS)
+    t_lxml, lxml_fields = bench("lxml + compiled spec", lambda d: extract_lxml(extractor, d), pages)
+    t_extract = time.perf_counter()
+    tree = parse_html(pages[-1])
+    for _ in range(n):
+        extractor.extract(tree)
+    print(f"{'  of which extraction only':<28}: {1e3 * (time.perf_counter() - t_extract) / n:7.3f} ms/page")
+    mismatches = [k for k in soup_fields if soup_fields[k] != lxml_fields[k]
+                  and k != "info_details"] # same html, bs4 and lxml serialize attributes in a different order
+    print(f"speedup x{t_soup / t_lxml:.1f}, fields differing: {mismatches or 'none'}")
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    items = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    main(n, items)
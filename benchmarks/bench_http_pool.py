@@ -0,0 +1,119 @@
+"""
+Benchmark connection setup overhead: session per request, one default session per crawler, shared tuned pool
+
+Two crawlers each fetch a burst of requests from a local HTTPS server, idle for gap seconds (longer than aiohttp's
+default 15s keep-alive and 10s DNS cache), then fetch a second burst.
+Usage: python -m benchmarks.bench_http_pool [requests_per_burst] [gap_seconds]   (default: 200 20)
+Needs the openssl command line tool (self-signed certificate for localhost).
+"""
+import ssl
+import sys
+import time
+import asyncio
+import tempfile
+import subprocess
+import aiohttp
+from pathlib import Path
+from aiohttp import web
+from lib.dcs_http import KahHttpPool
+
+PORT = 8443
+CONCURRENCY = 8
+
+def make_certificate(path: Path) -> tuple[Path, Path]:
+    cert, key = path / "cert.pem", path / "key.pem"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=DNS:localhost", "-keyout", str(key), "-out", str(cert)],
+                   check=True, capture_output=True)
+    return cert, key
+
+class Counters:
+    def __init__(self) -> None:
+        self.connections = 0
+        self.dns = 0
+        self.connect_time = 0.0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+        async def on_create_start(session, ctx, params):
+            ctx.t0 = time.perf_counter()
+        async def on_create_end(session, ctx, params):
+            self.connections += 1
+            self.connect_time += time.perf_counter() - ctx.t0
+        async def on_dns_end(session, ctx, params):
+            self.dns += 1
+        trace.on_connection_create_start.append(on_create_start)
+        trace.on_connection_create_end.append(on_create_end)
+        trace.on_dns_resolvehost_end.append(on_dns_end)
+        return trace
+
+async def burst(session_factory, n: int) -> None:
+    """n requests; session_factory() -> (session, close_after_request)"""
+    url = f"https://localhost:{PORT}/item.js"
+    sem = asyncio.Semaphore(CONCURRENCY)
+    async def one() -> None:
+        async with sem:
+            session, close_after = session_factory()
+            try:
+                async with session.get(url) as resp:
+                    await resp.read()
+            finally:
+                if close_after:
+                    await session.close()
+    await asyncio.gather(*(one() for _ in range(n)))
+
+async def scenario(name: str, crawler_factories: list, sessions: list[aiohttp.ClientSession], counters: Counters, n: int, gap: float) -> None:
+    """Each crawler (session factory) runs a burst, idles gap seconds, then runs another one."""
+    timings = []
+    for i in range(2):
+        if i:
+            await asyncio.sleep(gap)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(burst(factory, n) for factory in crawler_factories))
+        timings.append(time.perf_counter() - t0)
+    for session in sessions:
+        await session.close()
+
+    total = 2 * len(crawler_factories) * n
+    print(f"{name:<22}: {counters.connections:5d} connections  {counters.dns:4d} dns lookups  "
+          f"connect+tls {1e3 * counters.connect_time / total:6.2f} ms/request  "
+          f"bursts {1e3 * timings[0] / (total / 2):5.2f} / {1e3 * timings[1] / (total / 2):5.2f} ms/request")
+
+async def main(n: int, gap: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_certificate(Path(tmp))
+        server_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_ctx.load_cert_chain(cert, key)
+        client_ctx = ssl.create_default_context(cafile=str(cert))
+
+        async def handler(request: web.Request) -> web.Response:
+            return web.json_response({"handle": "item", "images": ["//cdn.example/a.jpg"] * 8})
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "localhost", PORT, ssl_context=server_ctx).start()
+
+        def default_session(counters: Counters) -> aiohttp.ClientSession:
+            return aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=client_ctx), trace_configs=[counters.trace_config()])
+
+        print(f"2 crawlers x 2 bursts x {n} requests, {gap:.0f}s idle between bursts, concurrency {CONCURRENCY}")
+
+        counters = Counters()
+        per_request = lambda: (default_session(counters), True)
+        await scenario("session per request", [per_request, per_request], [], counters, n, gap)
+
+        counters = Counters()
+        sessions = [default_session(counters), default_session(counters)]
+        await scenario("default session each", [lambda s=s: (s, False) for s in sessions], sessions, counters, n, gap)
+
+        counters = Counters()
+        pool = KahHttpPool(limit_per_host=CONCURRENCY, ssl_context=client_ctx, trace_configs=[counters.trace_config()])
+        shared = lambda: (pool.session(), False)
+        await scenario("shared tuned pool", [shared, shared], [pool.session()], counters, n, gap)
+        await runner.cleanup()
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    gap = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    asyncio.run(main(n, gap))
@@ -0,0 +1,64 @@
+"""
+Benchmark the compact fingerprint skip index against the plain python set
+
+Usage: python -m benchmarks.bench_skip_index [sizes...]   (default: 1000000 10000000 50000000)
+Note: the set at 50M urls needs ~8 GB of RAM.
+"""
+import sys
+import time
+import random
+from lib.dcs_skip_index import KahFingerprintSkipIndex
+
+def gen_urls(n: int, salt: str = "") -> list[str]:
+    """Urls shaped like the ones in our indexes (Shopify images, item json)"""
+    out = []
+    for i in range(n):
+        if i % 4:
+            out.append(f"https://cdn.shopify.com/s/files/1/0558/1234/5678/files/{salt}{i:010d}_a1b2c3d4.jpg?v=17{i:08d}")
+        else:
+            out.append(f"https://shop.akbh.jp/products/{salt}item-{i:010d}-limited-edition.js")
+    return out
+
+def set_memory_bytes(s: set[str]) -> int:
+    return sys.getsizeof(s) + sum(sys.getsizeof(u) for u in s)
+
+def bench(n: int, n_queries: int = 200_000) -> None:
+    urls = gen_urls(n)
+    unseen = gen_urls(n_queries, salt="x")
+    seen = random.sample(urls, min(n_queries, n))
+
+    t0 = time.perf_counter()
+    url_set = set(urls)
+    t_set_build = time.perf_counter() - t0
+    mem_set = set_memory_bytes(url_set)
+    t0 = time.perf_counter()
+    hits_set = sum(u in url_set for u in seen) + sum(u in url_set for u in unseen)
+    t_set_query = time.perf_counter() - t0
+    del url_set
+
+    index = KahFingerprintSkipIndex(None)
+    t0 = time.perf_counter()
+    index.bulk_load(urls)
+    t_fp_build = time.perf_counter() - t0
+    del urls
+    mem_fp = index.memory_bytes()
+    t0 = time.perf_counter()
+    hits_fp = sum(u in index for u in seen) + sum(u in index for u in unseen)
+    t_fp_query = time.perf_counter() - t0
+
+    bloom = index._bloom
+    from lib.dcs_skip_index import url_fingerprint
+    bloom_fp = sum(url_fingerprint(u) in bloom for u in unseen) / len(unseen)
+
+    print(f"n={n:,}")
+    print(f"  set        : build {t_set_build:6.2f}s  mem {mem_set / n:6.1f} B/url  "
+          f"lookup {1e9 * t_set_query / (2 * n_queries):6.0f} ns  hits={hits_set}")
+    print(f"  fingerprint: build {t_fp_build:6.2f}s  mem {mem_fp / n:6.1f} B/url  "
+          f"lookup {1e9 * t_fp_query / (2 * n_queries):6.0f} ns  hits={hits_fp}")
+    print(f"  bloom false positives: measured {bloom_fp:.4%}, expected {bloom.expected_false_positive_rate():.4%}")
+    print(f"  url fingerprint collision bound: {n * n / 2 ** 65:.2e}")
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [1_000_000, 10_000_000, 50_000_000]
+    for size in sizes:
+        bench(size)
@@ -0,0 +1,190 @@
+"""
+Buffered append-only line log
+Batches lines in memory and flushes them to disk as a single write (group commit)
+"""
+import os
+import atexit
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from logging import Logger
+from typing import Iterable, Iterator, Optional
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+@contextmanager
+def _file_lock(fd: int) -> Iterator[None]:
+    """Exclusive advisory lock on fd between processes (no-op where fcntl is unavailable)."""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+def fsync_dir(path: Path) -> None:
+    """fsync a directory so renames in it are durable (no-op where unsupported)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def atomic_write_lines(path: Path, lines: Iterable[str]) -> None:
+    """Write lines to a temp file, fsync it, then rename it over path: readers see the old or the new file, never a mix."""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        f.writelines(line + "\n" for line in lines)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_dir(path.parent)
+
+class KahAppendLog:
+    """Append lines to a file, flushing them in batches.
+
+    Durability policy:
+        * flush_every_n: flush once that many lines are pending (1 = flush every line)
+        * flush_every_ms: flush pending lines at least that often (None = only on size / close)
+        * fsync: fsync the file after each flush (survives OS crashes, not only process kills)
+
+    Each batch is written with a single write() of complete lines, under an exclusive flock where
+    available, so several processes may append to the same file without interleaving lines. After an
+    unclean kill, at most the pending batch is lost and a torn trailing line is ignored by read_lines()."""
+
+    def __init__(self,
+                 path: Path,
+                 flush_every_n: int = 64,
+                 flush_every_ms: Optional[float] = 1000.0,
+                 fsync: bool = False,
+                 close_at_exit: bool = True,
+                 logger: Optional[Logger] = None) -> None:
+        self.path = path
+        self.flush_every_n = max(1, flush_every_n)
+        self.flush_every_ms = flush_every_ms
+        self.fsync = fsync
+        self.logger = logger
+
+        self._pending: list[str] = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._repair_torn_tail()
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        self._flusher: Optional[threading.Thread] = None
+        if self.flush_every_ms:
+            self._flusher = threading.Thread(target=self._flush_loop, name=f"KahAppendLog({self.path.name})", daemon=True)
+            self._flusher.start()
+        if close_at_exit:
+            atexit.register(self.close)
+
+    # =======================
+    # Writing
+    # =======================
+
+    def append(self, line: str) -> None:
+        """Queue a line (without trailing newline), flushing if the batch is full."""
+        with self._lock:
+            self._pending.append(line)
+            if len(self._pending) >= self.flush_every_n:
+                self._flush_locked()
+
+    def extend(self, lines: Iterable[str]) -> None:
+        """Queue several lines at once."""
+        with self._lock:
+            self._pending.extend(lines)
+            if len(self._pending) >= self.flush_every_n:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        """Write all pending lines to disk."""
+        with self._lock:
+            self._flush_locked()
+
+    def rewrite(self, lines: Iterable[str]) -> None:
+        """Atomically replace the whole file content with lines (pending lines are flushed first), then keep appending to it."""
+        with self._lock:
+            self._flush_locked()
+            atomic_write_lines(self.path, lines)
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def close(self) -> None:
+        """Flush pending lines and close the file. Safe to call several times."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            self._flush_locked()
+            os.close(self._fd)
+        atexit.unregister(self.close)
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        buf = ("\n".join(self._pending) + "\n").encode("utf-8")
+        self._pending.clear()
+        view = memoryview(buf)
+        with _file_lock(self._fd):
+            while view:  # os.write may be partial for large batches
+                written = os.write(self._fd, view)
+                view = view[written:]
+        if self.fsync:
+            os.fsync(self._fd)
+        if self.logger:
+            self.logger.debug(f"Flushed {len(buf)} bytes to append log at path={self.path}.")
+
+    def _flush_loop(self) -> None:
+        interval = self.flush_every_ms / 1000.0
+        while not self._closed.wait(interval):
+            self.flush()
+
+    # =======================
+    # Reading
+    # =======================
+
+    def _repair_torn_tail(self) -> None:
+        """Truncate a torn trailing line left by a crash so new lines do not get glued to it."""
+        if not self.path.exists():
+            return
+        with open(self.path, "rb+") as f, _file_lock(f.fileno()):
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:  # scan backwards for the last newline
+                start = max(0, pos - 4096)
+                f.seek(start)
+                idx = f.read(pos - start).rfind(b"\n")
+                if idx != -1:
+                    pos = start + idx + 1
+                    break
+                pos = start
+            if pos != end:
+                if self.logger:
+                    self.logger.warning(f"Dropping torn trailing line ({end - pos} bytes) in append log at path={self.path}.")
+                f.truncate(pos)
+
+    @staticmethod
+    def read_lines(path: Path) -> Iterator[str]:
+        """Iterate the complete, non-empty lines of an append log. A torn trailing line is skipped."""
+        if not path.exists():
+            return
+        with open(path, "r", encoding="utf-8", errors="replace", newline="\n") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    return  # torn write
+                line = line.rstrip("\r\n")
+                if line:
+                    yield line
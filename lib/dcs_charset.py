@@ -0,0 +1,89 @@
+"""
+Charset resolution
+Find the encoding of a body from its BOM, the Content-Type charset or a <meta charset> in its first KB, remembering
+what worked per host, so that bodies are decoded once instead of trial-decoded with every candidate encoding.
+"""
+import re
+import codecs
+from logging import Logger
+from typing import Optional
+from aiohttp import ClientResponse
+
+FALLBACK_ENCODINGS = ("utf-8", "shift-jis", "big5", "gbk")
+SNIFF_BYTES = 4096
+PREVIEW_CHARS = 40
+
+BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+CONTENT_TYPE_CHARSET = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+META_CHARSET = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+
+def _normalize(name: str | bytes) -> Optional[str]:
+    """Python codec name of name, None if unknown."""
+    if isinstance(name, bytes):
+        name = name.decode("ascii", errors="ignore")
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+def sniff_charset(data: bytes, content_type: Optional[str] = None, sniff_bytes: int = SNIFF_BYTES) -> Optional[str]:
+    """Encoding declared for data: BOM, then Content-Type charset, then <meta charset> in the first sniff_bytes."""
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding
+    if content_type:
+        match = CONTENT_TYPE_CHARSET.search(content_type)
+        if match and (encoding := _normalize(match.group(1))):
+            return encoding
+    match = META_CHARSET.search(data, 0, sniff_bytes)
+    return _normalize(match.group(1)) if match else None
+
+class KahCharsetResolver:
+    """Decode bodies with, in order: their declared encoding (see sniff_charset), utf-8, the last encoding that
+    worked for their host, FALLBACK_ENCODINGS. Declarations can be wrong: a failed decode moves on to the next
+    candidate. utf-8 goes before the host encoding: short utf-8 texts often decode without error (and garbled)
+    as shift-jis or gbk, while legacy encoded texts almost never pass as utf-8."""
+
+    def __init__(self, fallbacks: tuple[str, ...] = FALLBACK_ENCODINGS, logger: Optional[Logger] = None) -> None:
+        self.fallbacks = fallbacks
+        self.logger = logger
+        self._by_host: dict[str, str] = {}
+
+    def _candidates(self, data: bytes, content_type: Optional[str], host: Optional[str]) -> list[str]:
+        candidates = [sniff_charset(data, content_type), "utf-8", self._by_host.get(host) if host else None, *self.fallbacks]
+        return list(dict.fromkeys(c for c in candidates if c))
+
+    def decode(self, data: bytes, content_type: Optional[str] = None, host: Optional[str] = None) -> Optional[str]:
+        """data decoded, None if no candidate encoding fits."""
+        for encoding in self._candidates(data, content_type, host):
+            try:
+                text = data.decode(encoding)
+            except (UnicodeDecodeError, LookupError):
+                continue
+            if host and self._by_host.get(host) != encoding:
+                self._by_host[host] = encoding
+                if self.logger:
+                    self.logger.debug(f"Decoding bodies from {host} as {encoding}.")
+            return text
+        return None
+
+    def preview(self, data: bytes, n: int = PREVIEW_CHARS, content_type: Optional[str] = None, host: Optional[str] = None) -> str:
+        """First n characters of data, decoding only its first bytes."""
+        head = data[:4 * n] # at most 4 bytes per character
+        for encoding in self._candidates(head, content_type, host):
+            for cut in range(4 if len(head) < len(data) else 1): # head may end in the middle of a character
+                try:
+                    return head[:len(head) - cut].decode(encoding)[:n]
+                except (UnicodeDecodeError, LookupError):
+                    continue
+        return str(head)[:n]
+
+CHARSETS = KahCharsetResolver()
+
+def preview(data: Optional[bytes], n: int = PREVIEW_CHARS, resp: Optional[ClientResponse] = None) -> Optional[str]:
+    """First n characters of data (for logs), using the charset and host of resp if given. None if no data."""
+    if not data:
+        return None
+    if resp is None:
+        return CHARSETS.preview(data, n)
+    return CHARSETS.preview(data, n, resp.headers.get("Content-Type"), resp.url.host)
@@ -0,0 +1,98 @@
+"""
+Declarative html extraction
+Shops declare the fields of their pages as selectors, compiled once to lxml XPath objects and evaluated over an
+lxml tree, instead of walking BeautifulSoup trees with find/find_all/select calls for every page.
+"""
+from logging import Logger
+from typing import Any, Callable, Optional
+from lxml import etree, html
+
+from .dcs_charset import sniff_charset
+
+try:
+    from cssselect import HTMLTranslator
+except ImportError: # optional, only needed for css selectors
+    HTMLTranslator = None
+
+def text_of(element: etree._Element) -> str:
+    """Text of element like BeautifulSoup get_text(strip=True): stripped text pieces, joined."""
+    return "".join(s.strip() for s in element.itertext())
+
+VALUE_GETTERS: dict[str, Callable[[etree._Element], Any]] = {
+    "text": text_of,
+    "html": lambda element: html.tostring(element, encoding="unicode", with_tail=False),
+    "attrs": lambda element: dict(element.attrib),
+    "element": lambda element: element,
+}
+
+class KahField:
+    """Field of a page.
+
+    selector: css selector, or xpath expression if xpath=True
+    value: "text" (see text_of), "html" (outer html), "attrs" (dict of attributes), "element" (lxml element)
+        or "@name" (attribute name, matches without it are skipped)
+    many: list of the values of all matches (possibly empty) instead of the first one (None if no match)
+    transform: applied to each value"""
+
+    def __init__(self,
+                 selector: str,
+                 value: str = "text",
+                 many: bool = False,
+                 xpath: bool = False,
+                 transform: Optional[Callable[[Any], Any]] = None) -> None:
+        if not value.startswith("@") and value not in VALUE_GETTERS:
+            raise ValueError(f"Unknown field value: {value}")
+        self.selector = selector
+        self.value = value
+        self.many = many
+        self.xpath = xpath
+        self.transform = transform
+
+    def compile(self) -> etree.XPath:
+        if self.xpath:
+            path = self.selector
+        elif HTMLTranslator is None:
+            raise ImportError(f"cssselect is required for css selector {self.selector!r}")
+        else:
+            path = HTMLTranslator().css_to_xpath(self.selector)
+        if self.value.startswith("@"): # let libxml2 pick the attribute
+            path = f"({path})/{self.value}"
+        if not self.many:
+            path = f"({path})[1]"
+        return etree.XPath(path)
+
+def parse_html(data: bytes | str, content_type: Optional[str] = None) -> etree._Element:
+    """lxml tree of a page, bytes being decoded with their declared charset (see sniff_charset)."""
+    if isinstance(data, str):
+        return html.document_fromstring(data)
+    encoding = sniff_charset(data, content_type)
+    parser = html.HTMLParser(encoding=encoding) if encoding else None
+    return html.document_fromstring(data, parser=parser)
+
+class KahExtractor:
+    """Extract a dict of fields (name -> KahField) from pages. Selectors are compiled once, on creation."""
+
+    def __init__(self, fields: dict[str, KahField], logger: Optional[Logger] = None) -> None:
+        self.fields = fields
+        self.logger = logger
+        self._compiled: list[tuple[str, KahField, etree.XPath, Optional[Callable[[etree._Element], Any]]]] = []
+        for name, field in fields.items():
+            try:
+                path = field.compile()
+            except (etree.XPathSyntaxError, SyntaxError) as e: # cssselect errors are SyntaxErrors
+                raise ValueError(f"Invalid selector for field {name}: {field.selector!r} ({e})") from e
+            getter = None if field.value.startswith("@") else VALUE_GETTERS[field.value]
+            self._compiled.append((name, field, path, getter))
+
+    def extract(self, page: bytes | str | etree._Element, content_type: Optional[str] = None) -> dict[str, Any]:
+        """Fields of page (raw html or tree from parse_html)."""
+        tree = page if isinstance(page, etree._Element) else parse_html(page, content_type)
+        out = {}
+        for name, field, path, getter in self._compiled:
+            values = [str(m) if getter is None else getter(m) for m in path(tree)]
+            if field.transform is not None:
+                values = [field.transform(v) for v in values]
+            out[name] = values if field.many else (values[0] if values else None)
+        if self.logger:
+            self.logger.debug(f"Extracted {sum(v is not None and v != [] for v in out.values())}/{len(out)} fields.")
+        return out
@@ -0,0 +1,524 @@
+"""
+Async fetcher with adaptive per-host concurrency
+Same interface as kahscrape's KahRatelimitedFetcher (fetch(url, callback, onerr), wait_and_close()),
+but each host gets its own AIMD controller instead of a single fixed wait time.
+"""
+import json
+import time
+import random
+import asyncio
+import aiohttp
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from logging import Logger
+from urllib.parse import urlsplit
+from typing import Any, Awaitable, Callable, Iterator, Optional
+from aiohttp import ClientResponse
+
+from .dcs_appendlog import KahAppendLog
+from .dcs_frontier import KahFrontier
+from .dcs_sched import KahPriorityScheduler
+from .dcs_httpcache import KahHttpCache, REVALIDATE_REPLAY, REVALIDATE_SKIP
+from .dcs_metrics import KahMetrics
+
+Callback = Callable[..., Awaitable[Any]] # callback(fetcher, resp, data), onerr(fetcher, url, e, resp=None, data=None)
+
+class KahHttpStatusError(Exception):
+    """Non-2xx/3xx response"""
+
+    def __init__(self, url: str, status: int, retry_after: Optional[float] = None) -> None:
+        super().__init__(f"HTTP {status} for {url}")
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delay in seconds or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# =======================
+# Per-host AIMD
+# =======================
+
+class KahHostLimits:
+    """Concurrency bounds of a host.
+
+    min_concurrency / max_concurrency: floor and ceiling of the concurrency limit
+    initial_concurrency: starting limit
+    min_wait_time: minimum delay between two request starts (seconds)
+    increase: additive increase per "window" of successful requests (one window = limit requests)
+    decrease: multiplicative factor applied on overload (429, 5xx, timeouts)"""
+
+    def __init__(self,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 8,
+                 initial_concurrency: Optional[int] = None,
+                 min_wait_time: float = 0.0,
+                 increase: float = 1.0,
+                 decrease: float = 0.5) -> None:
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.initial_concurrency = initial_concurrency or self.min_concurrency
+        self.min_wait_time = min_wait_time
+        self.increase = increase
+        self.decrease = decrease
+
+class KahAimdController:
+    """Adaptive concurrency limit of a single host: additive increase on success, multiplicative
+    decrease on overload (at most once per cooldown, so a burst of failing in-flight requests counts
+    once), and a pause honoring Retry-After."""
+
+    def __init__(self, host: str, limits: KahHostLimits, logger: Optional[Logger] = None) -> None:
+        self.host = host
+        self.limits = limits
+        self.logger = logger
+        self.limit = float(min(max(limits.initial_concurrency, limits.min_concurrency), limits.max_concurrency))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._last_start = 0.0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    def _wait_time(self) -> Optional[float]:
+        """None if a slot is free now, else seconds to wait (0 = wait for a release)."""
+        if self.in_flight >= int(self.limit):
+            return 0.0
+        now = time.monotonic()
+        wait = max(self.blocked_until - now, self._last_start + self.limits.min_wait_time - now)
+        return wait if wait > 0 else None
+
+    async def acquire(self) -> None:
+        """Wait for a slot. Not wrapped in wait_for, which can swallow a cancellation (python 3.11): a cancelled
+        caller never gets a slot."""
+        while True:
+            async with self._cond:
+                wait = self._wait_time()
+                if wait is None:
+                    self.in_flight += 1
+                    self._last_start = time.monotonic()
+                    return
+                if wait == 0:
+                    await self._cond.wait() # for a release
+                    continue
+            await asyncio.sleep(wait) # spacing or pause, outside the condition, then check again
+
+    async def release(self, overloaded: bool = False, retry_after: Optional[float] = None) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if overloaded:
+                cooldown = max(1.0, self.limits.min_wait_time * self.limit)
+                if now - self._last_decrease >= cooldown:
+                    self.limit = max(float(self.limits.min_concurrency), self.limit * self.limits.decrease)
+                    self._last_decrease = now
+                    if self.logger:
+                        self.logger.info(f"Host {self.host} overloaded, concurrency limit down to {self.limit:.2f}"
+                                         f"{f' (paused {retry_after:.1f}s)' if retry_after else ''}.")
+            else:
+                self.limit = min(float(self.limits.max_concurrency), self.limit + self.limits.increase / self.limit)
+            self._cond.notify_all()
+
+# =======================
+# Retries
+# =======================
+
+def classify_error(error: Exception) -> str:
+    """Error class used to pick a retry policy: timeout, connection, overload, server, client or callback."""
+    if isinstance(error, KahHttpStatusError):
+        if error.status in (408, 429, 503):
+            return "overload" if error.status != 408 else "timeout"
+        return "server" if error.status >= 500 else "client"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, aiohttp.ClientError):
+        return "connection"
+    return "callback"
+
+class KahRetryPolicy:
+    """Exponential backoff with full jitter: attempt n (0-based) waits uniform(0, min(max_delay, base_delay * 2**n)),
+    at least Retry-After if the server sent one. max_attempts counts the first try."""
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 60.0) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        backoff = random.uniform(0.0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(backoff, retry_after or 0.0)
+
+DEFAULT_RETRY_POLICIES = {
+    "timeout": KahRetryPolicy(max_attempts=4, base_delay=1.0),
+    "connection": KahRetryPolicy(max_attempts=4, base_delay=1.0),
+    "overload": KahRetryPolicy(max_attempts=6, base_delay=2.0, max_delay=120.0),
+    "server": KahRetryPolicy(max_attempts=3, base_delay=2.0),
+}
+
+class KahRetryBudget:
+    """Global token bucket capping retries to a fraction of the traffic: every first attempt deposits
+    ratio tokens (up to max_tokens), every retry spends one. A failing host thus cannot flood the queue
+    with retries."""
+
+    def __init__(self, ratio: float = 0.2, initial_tokens: float = 10.0, max_tokens: float = 100.0) -> None:
+        self.ratio = ratio
+        self.tokens = initial_tokens
+        self.max_tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+class KahDeadLetterLog:
+    """Json lines of urls that failed permanently ({"url", "kind", "args", "error_class", "error", "attempts", "time"}),
+    to be re-fed on the next run with drain()."""
+
+    def __init__(self, path: Path, logger: Optional[Logger] = None) -> None:
+        self.path = path
+        self.logger = logger
+        self._log = KahAppendLog(path, flush_every_n=1, flush_every_ms=None, logger=logger)
+
+    def add(self, url: str, error: Exception, attempts: int, kind: Optional[str] = None, args: Optional[dict] = None) -> None:
+        if self.logger:
+            self.logger.warning(f"Giving up on {url} after {attempts} attempts: {error=}")
+        self._log.append(json.dumps({"url": url, "kind": kind, "args": args or {}, "error_class": classify_error(error),
+                                     "error": repr(error), "attempts": attempts, "time": time.time()}, ensure_ascii=False))
+
+    def drain(self) -> Iterator[dict]:
+        """Take all records out of the log (each url once), for re-feeding."""
+        self._log.flush()
+        records = {}
+        for line in KahAppendLog.read_lines(self.path):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["url"]] = record
+        self._log.rewrite([])
+        return iter(records.values())
+
+# =======================
+# Fetcher
+# =======================
+
+class KahAdaptiveFetcher:
+    """Fetch urls concurrently, each host running at its own sustainable rate.
+
+    callback(fetcher, resp, data) is called for 2xx/3xx responses, onerr(fetcher, url, e, resp, data)
+    for other statuses (e is a KahHttpStatusError), network errors, timeouts and callback exceptions.
+    Hosts match host_limits entries on the host or a parent domain, else use default_limits.
+
+    Failed fetches are retried per error class (see classify_error, retry_policies) within the global
+    retry_budget. Urls still failing with a transient error class are written to dead_letters.
+
+    Urls fetched with a kind (and json-serializable args) are recorded in the frontier, if any, and
+    marked done once their callback returned: see KahFrontier. shutdown() stops starting new requests,
+    lets in-flight ones finish and checkpoints the frontier; unstarted urls stay pending there.
+    Cancelling the task returned by fetch() drops the url (marked cancelled in the frontier).
+
+    With a scheduler, urls are fetched with a priority class: fetch() waits while the class queue is full
+    and each url holds one of the scheduler's running slots from its request to the end of its callback
+    (not while backing off): see KahPriorityScheduler.
+
+    With an http_cache, urls fetched with revalidate=REVALIDATE_REPLAY or REVALIDATE_SKIP are requested
+    conditionally (If-None-Match / If-Modified-Since). On 304, or a 200 with the cached body, the callback
+    gets the cached body (replay) or is not called at all (skip).
+
+    Urls fetched with stream=True get their callback called with data=None while the response is open, to
+    read resp.content in chunks: the body is never held in memory. Network errors while streaming are
+    retried like any failed request (the callback must then discard what it wrote).
+
+    With metrics, requests (per host: count by status, bytes, latency, errors, retries, in-flight, concurrency
+    limit), callbacks (per kind: count by outcome, duration) and queues (tasks, scheduler classes) are recorded,
+    see KahMetrics."""
+    OVERLOAD_STATUSES = {429, 500, 502, 503, 504}
+    DEAD_LETTER_CLASSES = {"timeout", "connection", "overload", "server"}
+
+    def __init__(self,
+                 session: aiohttp.ClientSession,
+                 logger: Optional[Logger] = None,
+                 host_limits: Optional[dict[str, KahHostLimits]] = None,
+                 default_limits: Optional[KahHostLimits] = None,
+                 retry_policies: Optional[dict[str, KahRetryPolicy]] = None,
+                 retry_budget: Optional[KahRetryBudget] = None,
+                 dead_letters: Optional[KahDeadLetterLog] = None,
+                 frontier: Optional[KahFrontier] = None,
+                 scheduler: Optional[KahPriorityScheduler] = None,
+                 http_cache: Optional[KahHttpCache] = None,
+                 close_session: bool = True,
+                 metrics: Optional[KahMetrics] = None) -> None:
+        self.session = session
+        self.close_session = close_session # False for a session shared with other fetchers, see KahHttpPool
+        self.logger = logger
+        self.host_limits = {host.lower(): limits for host, limits in (host_limits or {}).items()}
+        self.default_limits = default_limits or KahHostLimits()
+        self.controllers: dict[str, KahAimdController] = {}
+        self.retry_policies = DEFAULT_RETRY_POLICIES if retry_policies is None else retry_policies
+        self.retry_budget = retry_budget or KahRetryBudget()
+        self.dead_letters = dead_letters
+        self.frontier = frontier
+        self.scheduler = scheduler
+        self.http_cache = http_cache
+        self.metrics = metrics
+        self.stopping = False
+        self._tasks: set[asyncio.Task] = set()
+        self._waiting: set[asyncio.Task] = set() # tasks not started yet or backing off, cancelled on shutdown
+        if metrics is not None:
+            self._register_gauges(metrics)
+
+    def _register_gauges(self, metrics: KahMetrics) -> None:
+        metrics.gauge("tasks", lambda: len(self._tasks))
+        metrics.gauge("in_flight", lambda: [({"host": host}, c.in_flight) for host, c in self.controllers.items()])
+        metrics.gauge("concurrency_limit", lambda: [({"host": host}, c.limit) for host, c in self.controllers.items()])
+        metrics.gauge("retry_budget_tokens", lambda: self.retry_budget.tokens)
+        if self.scheduler is not None:
+            metrics.gauge("queued", lambda: [({"class": name}, queued) for name, (queued, _) in self.scheduler.stats().items()])
+            metrics.gauge("waiting_slot", lambda: [({"class": name}, waiting) for name, (_, waiting) in self.scheduler.stats().items()])
+            metrics.gauge("running", lambda: self.scheduler.running)
+
+    def _controller(self, url: str) -> KahAimdController:
+        host = (urlsplit(url).hostname or "").lower()
+        controller = self.controllers.get(host)
+        if controller is None:
+            limits, parent = self.default_limits, host
+            while parent:
+                if parent in self.host_limits:
+                    limits = self.host_limits[parent]
+                    break
+                _, _, parent = parent.partition(".")
+            controller = self.controllers[host] = KahAimdController(host, limits, self.logger)
+        return controller
+
+    async def fetch(self, url: str, callback: Callback, onerr: Optional[Callback] = None,
+                    kind: Optional[str] = None, args: Optional[dict[str, Any]] = None,
+                    priority: Optional[str] = None, revalidate: Optional[str] = None, stream: bool = False) -> Optional[asyncio.Task]:
+        """Queue url, waiting while the queue of its priority class is full.
+        Returns the task handling it (None once stopping: the url only stays pending in the frontier)."""
+        if self.frontier is not None and kind is not None:
+            self.frontier.add(url, kind, args)
+        if self.stopping:
+            return None
+        if self.metrics is not None:
+            self.metrics.inc("urls_queued_total", kind=kind or "-")
+        if self.scheduler is not None and not await self.scheduler.admit(priority):
+            return None
+        if self.http_cache is None or stream: # revalidation needs the body
+            revalidate = None
+        task = asyncio.create_task(self._fetch(url, callback, onerr, kind, args, priority, revalidate, stream))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _wait_interruptible(self, awaitable: Awaitable[Any]) -> None:
+        """Await something that may be abandoned on shutdown (waiting for a slot, backoff)."""
+        task = asyncio.current_task()
+        self._waiting.add(task)
+        try:
+            await awaitable
+        finally:
+            self._waiting.discard(task)
+
+    async def _fetch(self, url: str, callback: Callback, onerr: Optional[Callback], kind: Optional[str],
+                     args: Optional[dict[str, Any]], priority: Optional[str], revalidate: Optional[str], stream: bool) -> None:
+        try:
+            await self._fetch_scheduled(url, callback, onerr, kind, args, priority, revalidate, stream)
+        except asyncio.CancelledError:
+            if self.frontier is not None and kind is not None and not self.stopping: # dropped by the caller, not by stop()
+                self.frontier.cancelled(url)
+            raise
+
+    async def _fetch_scheduled(self, url: str, callback: Callback, onerr: Optional[Callback], kind: Optional[str],
+                               args: Optional[dict[str, Any]], priority: Optional[str], revalidate: Optional[str], stream: bool) -> None:
+        if self.scheduler is None:
+            return await self._fetch_in_slot(url, callback, onerr, kind, args, priority, revalidate, stream)
+        await self._wait_interruptible(self.scheduler.acquire(priority))
+        try:
+            await self._fetch_in_slot(url, callback, onerr, kind, args, priority, revalidate, stream)
+        finally:
+            self.scheduler.release()
+
+    async def _fetch_in_slot(self, url: str, callback: Callback, onerr: Optional[Callback], kind: Optional[str],
+                             args: Optional[dict[str, Any]], priority: Optional[str], revalidate: Optional[str], stream: bool) -> None:
+        tracked = self.frontier is not None and kind is not None
+        headers = self.http_cache.request_headers(url, need_body=revalidate == REVALIDATE_REPLAY) if revalidate else None
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            if tracked:
+                self.frontier.started(url)
+            resp, data, error, retry_after = await self._attempt(url, headers, callback if stream else None)
+            if error is None:
+                break
+            error_class = classify_error(error)
+            policy = self.retry_policies.get(error_class)
+            if policy is None or attempt + 1 >= policy.max_attempts:
+                if self.dead_letters is not None and error_class in self.DEAD_LETTER_CLASSES:
+                    self.dead_letters.add(url, error, attempt + 1, kind, args)
+                    if self.metrics is not None:
+                        self.metrics.inc("dead_letters_total", kind=kind or "-")
+                break
+            if not self.retry_budget.try_spend():
+                if self.logger:
+                    self.logger.warning(f"Retry budget exhausted, not retrying {url} ({error=}).")
+                if self.dead_letters is not None:
+                    self.dead_letters.add(url, error, attempt + 1, kind, args)
+                    if self.metrics is not None:
+                        self.metrics.inc("dead_letters_total", kind=kind or "-")
+                break
+            if self.metrics is not None:
+                self.metrics.inc("retries_total", host=self._controller(url).host, error_class=error_class)
+            delay = policy.delay(attempt, retry_after)
+            if self.logger:
+                self.logger.info(f"Retrying {url} in {delay:.1f}s (attempt {attempt + 2}/{policy.max_attempts}, {error_class}: {error!r}).")
+            if self.scheduler is None:
+                await self._wait_interruptible(asyncio.sleep(delay))
+            else: # free the slot while backing off
+                self.scheduler.release()
+                await self._wait_interruptible(asyncio.sleep(delay))
+                await self._wait_interruptible(self.scheduler.acquire(priority, admitted=False))
+            attempt += 1
+
+        if error is None and stream: # callback already ran within the response
+            if tracked:
+                self.frontier.done(url)
+            self._record_callback(kind, "ok")
+            return
+        if error is None:
+            t0 = time.perf_counter()
+            try:
+                if revalidate and not self._revalidated(url, revalidate, resp, data):
+                    if tracked:
+                        self.frontier.done(url)
+                    self._record_callback(kind, "skipped")
+                    return
+                body = self.http_cache.body(url) if revalidate == REVALIDATE_REPLAY and resp.status == 304 else data
+                await callback(self, resp, body)
+                if revalidate: # only once processed: a failed callback must not turn the next fetch into a skipped 304
+                    self._cache_response(url, revalidate, resp, data)
+                if tracked:
+                    self.frontier.done(url)
+                self._record_callback(kind, "ok", time.perf_counter() - t0)
+                return
+            except Exception as e:
+                self._record_callback(kind, "error", time.perf_counter() - t0)
+                error = e
+        if tracked:
+            self.frontier.failed(url)
+        if self.logger:
+            self.logger.debug(f"Fetch of {url} failed: {error=}")
+        if onerr is not None:
+            await onerr(self, url, error, resp, data)
+
+    def _record_callback(self, kind: Optional[str], outcome: str, elapsed: Optional[float] = None) -> None:
+        if self.metrics is None:
+            return
+        self.metrics.inc("callbacks_total", kind=kind or "-", outcome=outcome)
+        if elapsed is not None:
+            self.metrics.observe("callback_seconds", elapsed, kind=kind or "-")
+
+    def _record_attempt(self, host: str, resp: Optional[ClientResponse], data: Optional[bytes], error: Optional[Exception], elapsed: float) -> None:
+        if self.metrics is None:
+            return
+        self.metrics.observe("request_seconds", elapsed, host=host)
+        if resp is not None:
+            self.metrics.inc("requests_total", host=host, status=str(resp.status))
+            size = len(data) if data is not None else getattr(resp.content, "total_bytes", 0) # streamed: read by the callback
+            self.metrics.inc("response_bytes_total", size, host=host)
+        if error is not None:
+            self.metrics.inc("request_errors_total", host=host, error_class=classify_error(error))
+
+    def _revalidated(self, url: str, revalidate: str, resp: ClientResponse, data: bytes) -> bool:
+        """Return False if the callback is to be skipped: not modified since the last successful callback."""
+        if resp.status != 304 and self.http_cache.is_changed(url, data):
+            return True
+        if self.logger:
+            self.logger.debug(f"Not modified: {url}{' (callback skipped)' if revalidate == REVALIDATE_SKIP else ''}")
+        if revalidate != REVALIDATE_SKIP:
+            return True
+        self._cache_response(url, revalidate, resp, data)
+        return False
+
+    def _cache_response(self, url: str, revalidate: str, resp: ClientResponse, data: bytes) -> None:
+        """Update the http cache with a processed response."""
+        if resp.status == 304:
+            self.http_cache.touch(url, resp.headers)
+        else:
+            self.http_cache.store(url, resp.headers, data, keep_body=revalidate == REVALIDATE_REPLAY)
+
+    async def _attempt(self, url: str, headers: Optional[dict[str, str]] = None, stream_callback: Optional[Callback] = None
+                       ) -> tuple[Optional[ClientResponse], Optional[bytes], Optional[Exception], Optional[float]]:
+        """Single request under the host controller. Return (resp, data, error, retry_after).
+        If stream_callback is set, it reads successful responses itself (data is then None)."""
+        controller = self._controller(url)
+        await self._wait_interruptible(controller.acquire())
+        resp: Optional[ClientResponse] = None
+        data: Optional[bytes] = None
+        error: Optional[Exception] = None
+        overloaded, retry_after = False, None
+        t0 = time.perf_counter()
+        try:
+            async with self.session.get(url, headers=headers) as resp:
+                if stream_callback is not None and resp.status < 400:
+                    await stream_callback(self, resp, None)
+                else:
+                    data = await resp.read()
+            if resp.status >= 400:
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                overloaded = resp.status in self.OVERLOAD_STATUSES
+                error = KahHttpStatusError(url, resp.status, retry_after)
+        except (asyncio.TimeoutError, aiohttp.ServerDisconnectedError, aiohttp.ClientConnectionError) as e:
+            overloaded, error = True, e
+        except aiohttp.ClientError as e:
+            error = e
+        except Exception as e: # stream_callback failure
+            error = e
+        finally:
+            await controller.release(overloaded, retry_after)
+        self._record_attempt(controller.host, resp, data, error, time.perf_counter() - t0)
+        return resp, data, error, retry_after
+
+    async def wait(self) -> None:
+        """Wait until all queued urls, including those queued by callbacks, are handled."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def wait_and_close(self) -> None:
+        await self.wait()
+        if self.frontier is not None:
+            self.frontier.checkpoint()
+        if self.http_cache is not None:
+            self.http_cache.checkpoint()
+        if self.close_session:
+            await self.session.close()
+
+    def stop(self) -> None:
+        """Stop starting requests: unstarted and backing-off urls are abandoned (left pending in the frontier),
+        in-flight ones finish. Safe to call from a signal handler."""
+        if self.stopping:
+            return
+        self.stopping = True
+        if self.scheduler is not None:
+            self.scheduler.close()
+        if self.logger:
+            self.logger.warning(f"Stopping: draining in-flight requests, {len(self._waiting)} queued urls left for next run.")
+        for task in list(self._waiting):
+            task.cancel()
+
+    async def shutdown(self) -> None:
+        """stop(), then drain in-flight requests, checkpoint the frontier and close the session."""
+        self.stop()
+        await self.wait_and_close()
@@ -0,0 +1,80 @@
+"""
+Persistent crawl frontier
+Every queued url is recorded with the kind of callback handling it, so an interrupted crawl can resume exactly its pending work.
+"""
+import json
+import time
+from typing import Any, Iterator, Optional
+
+from .dcs_sqlite import KahSqliteDb
+
+class KahFrontier(KahSqliteDb):
+    """SQLite queue of (url, kind, args, state, attempts).
+
+    states: pending (queued or in flight when the process stopped), done, failed, cancelled (e.g. speculative
+    pages found to be past the end, see KahPaginator).
+    A url is marked done only after its callback returned, i.e. after the urls it discovered were added:
+    after a crash, work is redone at least once, never lost. Writes are committed every commit_every_n
+    operations, every commit_every_ms and on checkpoint().
+
+    A crawl session starts with begin_session(): if pending work is left from an interrupted session it
+    is kept (resume), else the previous session's rows are cleared (fresh crawl)."""
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS frontier (url TEXT PRIMARY KEY, kind TEXT NOT NULL, args TEXT NOT NULL, "
+        "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, updated REAL NOT NULL) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS frontier_state ON frontier (state)",
+    )
+
+    # =======================
+    # Session
+    # =======================
+
+    def count(self, state: str = "pending") -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM frontier WHERE state = ?", (state,)).fetchone()[0]
+
+    def begin_session(self) -> bool:
+        """Return True if an interrupted session is resumed (pending work left), else start a fresh one."""
+        pending = self.count("pending")
+        if pending:
+            if self.logger:
+                self.logger.info(f"Resuming crawl frontier at path={self.path_db}: {pending} pending urls.")
+            return True
+        self._conn.execute("DELETE FROM frontier")
+        self.checkpoint()
+        return False
+
+    def pending(self) -> Iterator[tuple[str, str, dict[str, Any]]]:
+        """(url, kind, args) of all pending urls."""
+        rows = self._conn.execute("SELECT url, kind, args FROM frontier WHERE state = 'pending' ORDER BY updated").fetchall()
+        for url, kind, args in rows:
+            yield url, kind, json.loads(args)
+
+    # =======================
+    # Updates
+    # =======================
+
+    def add(self, url: str, kind: str, args: Optional[dict[str, Any]] = None) -> None:
+        """Record url as pending (a failed or cancelled url is queued again, a done one is left done)."""
+        self._conn.execute(
+            "INSERT INTO frontier (url, kind, args, state, updated) VALUES (?, ?, ?, 'pending', ?) "
+            "ON CONFLICT (url) DO UPDATE SET state = 'pending', kind = excluded.kind, args = excluded.args, updated = excluded.updated "
+            "WHERE state IN ('failed', 'cancelled')",
+            (url, kind, json.dumps(args or {}, ensure_ascii=False), time.time()))
+        self._wrote()
+
+    def started(self, url: str) -> None:
+        self._conn.execute("UPDATE frontier SET attempts = attempts + 1 WHERE url = ?", (url,))
+        self._wrote()
+
+    def done(self, url: str) -> None:
+        self._set_state(url, "done")
+
+    def failed(self, url: str) -> None:
+        self._set_state(url, "failed")
+
+    def cancelled(self, url: str) -> None:
+        self._set_state(url, "cancelled")
+
+    def _set_state(self, url: str, state: str) -> None:
+        self._conn.execute("UPDATE frontier SET state = ?, updated = ? WHERE url = ?", (state, time.time(), url))
+        self._wrote()
@@ -0,0 +1,105 @@
+"""
+Shared, tuned HTTP connection pool
+One pooled aiohttp session per process (or per name), shared by every crawler: connections, DNS cache and
+TLS context are reused across shops instead of being rebuilt by each fetcher.
+"""
+import ssl
+import socket
+import aiohttp
+from logging import Logger
+from typing import Iterable, Optional
+
+from .dcs_fetch import KahHostLimits
+
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10.0, sock_read=30.0) # no total: streamed bodies may be large
+
+def keepalive_socket_factory(idle: int = 30, interval: int = 10, count: int = 3):
+    """aiohttp socket_factory enabling TCP keep-alive probes, so dead pooled connections are detected
+    instead of hanging the next request."""
+    def factory(addr_info) -> socket.socket:
+        family, type_, proto, _, _ = addr_info
+        sock = socket.socket(family=family, type=type_, proto=proto)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+            if hasattr(socket, option): # Linux; partly missing on macOS / Windows
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+        return sock
+    return factory
+
+class KahHttpPool:
+    """Lazily created aiohttp session with a tuned connector.
+
+    limit: total connections
+    limit_per_host: connections per host; if None, the largest max_concurrency of host_limits (the AIMD
+        controllers never need more, see KahAdaptiveFetcher), else unlimited
+    ttl_dns_cache: seconds DNS answers are reused
+    keepalive_timeout: seconds an idle connection is kept for reuse (no new TCP/TLS handshake)
+    tcp_keepalive: enable TCP keep-alive probes on pooled sockets
+    ssl_context: TLS context of all connections (None: aiohttp's default one). asyncio cannot resume TLS
+        sessions on new sockets, so TLS handshakes are saved by keeping connections alive instead
+    headers: default request headers (aiohttp negotiates gzip/deflate, and br/zstd when available, by itself)
+    trace_configs: aiohttp request tracing hooks
+
+    Fetchers using it are created with close_session=False, the pool being closed once by its owner."""
+
+    def __init__(self,
+                 limit: int = 100,
+                 limit_per_host: Optional[int] = None,
+                 host_limits: Iterable[KahHostLimits] = (),
+                 ttl_dns_cache: int = 300,
+                 keepalive_timeout: float = 60.0,
+                 tcp_keepalive: bool = True,
+                 timeout: aiohttp.ClientTimeout = DEFAULT_TIMEOUT,
+                 ssl_context: Optional[ssl.SSLContext] = None,
+                 headers: Optional[dict[str, str]] = None,
+                 trace_configs: Optional[list[aiohttp.TraceConfig]] = None,
+                 logger: Optional[Logger] = None) -> None:
+        if limit_per_host is None:
+            limit_per_host = max((limits.max_concurrency for limits in host_limits), default=0)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.tcp_keepalive = tcp_keepalive
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.headers = headers
+        self.trace_configs = trace_configs
+        self.logger = logger
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def session(self) -> aiohttp.ClientSession:
+        """The shared session (created on first use, from within the event loop)."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.ttl_dns_cache,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=self.ssl_context if self.ssl_context is not None else True,
+                socket_factory=keepalive_socket_factory() if self.tcp_keepalive else None)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers=self.headers,
+                                                  trace_configs=self.trace_configs)
+            if self.logger:
+                self.logger.debug(f"Opened HTTP pool (limit={self.limit}, limit_per_host={self.limit_per_host}, "
+                                  f"dns ttl={self.ttl_dns_cache}s, keep-alive={self.keepalive_timeout}s).")
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+_POOLS: dict[str, KahHttpPool] = {}
+
+def get_pool(name: str = "default", **kwargs) -> KahHttpPool:
+    """Process-wide pool registered under name, created with kwargs (see KahHttpPool) on first call."""
+    pool = _POOLS.get(name)
+    if pool is None:
+        pool = _POOLS[name] = KahHttpPool(**kwargs)
+    return pool
+
+async def close_pools() -> None:
+    for pool in _POOLS.values():
+        await pool.close()
+    _POOLS.clear()
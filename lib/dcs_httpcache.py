@@ -0,0 +1,87 @@
+"""
+HTTP validator cache for conditional re-crawls
+Validators (ETag, Last-Modified, body sha256) of fetched urls are kept between runs, so re-crawls send
+If-None-Match / If-Modified-Since and unchanged pages cost a 304 instead of a full body.
+"""
+import time
+from hashlib import sha256
+from pathlib import Path
+from logging import Logger
+from typing import Mapping, Optional
+
+from .dcs_sqlite import KahSqliteDb
+
+REVALIDATE_REPLAY = "replay" # on 304 (or unchanged body), call the callback with the cached body
+REVALIDATE_SKIP = "skip" # on 304 (or unchanged body), do not call the callback
+
+class KahHttpCache(KahSqliteDb):
+    """SQLite table url -> (etag, last_modified, sha256 of the body, body).
+    Bodies are only kept for urls revalidated in replay mode. Writes are committed every commit_every_n
+    updates, every commit_every_ms and on checkpoint()."""
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS http_cache (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+              "digest TEXT NOT NULL, body BLOB, updated REAL NOT NULL) WITHOUT ROWID",)
+
+    def __init__(self, path_db: Path, commit_every_n: int = 64, commit_every_ms: float = 1000.0, logger: Optional[Logger] = None) -> None:
+        super().__init__(path_db, commit_every_n, commit_every_ms, logger)
+        self.not_modified = 0 # 304 responses
+        self.unchanged = 0 # 200 responses with the cached body
+        self.changed = 0 # new or changed bodies
+
+    # =======================
+    # Lookup
+    # =======================
+
+    def request_headers(self, url: str, need_body: bool = False) -> dict[str, str]:
+        """Conditional request headers for url (empty if nothing usable is cached)."""
+        row = self._conn.execute("SELECT etag, last_modified, body IS NOT NULL FROM http_cache WHERE url = ?", (url,)).fetchone()
+        if row is None or (need_body and not row[2]):
+            return {}
+        etag, last_modified, _ = row
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def is_changed(self, url: str, data: bytes) -> bool:
+        """Whether data differs from the body last stored for url."""
+        row = self._conn.execute("SELECT digest FROM http_cache WHERE url = ?", (url,)).fetchone()
+        return row is None or row[0] != sha256(data).hexdigest()
+
+    def body(self, url: str) -> Optional[bytes]:
+        row = self._conn.execute("SELECT body FROM http_cache WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    # =======================
+    # Updates
+    # =======================
+
+    def store(self, url: str, headers: Mapping[str, str], data: bytes, keep_body: bool = False) -> bool:
+        """Record the validators of a 200 response, once it is processed. Return False if the body is the cached one."""
+        digest = sha256(data).hexdigest()
+        row = self._conn.execute("SELECT digest FROM http_cache WHERE url = ?", (url,)).fetchone()
+        changed = row is None or row[0] != digest
+        self._conn.execute(
+            "INSERT OR REPLACE INTO http_cache (url, etag, last_modified, digest, body, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (url, headers.get("ETag"), headers.get("Last-Modified"), digest, data if keep_body else None, time.time()))
+        self._wrote()
+        if changed:
+            self.changed += 1
+        else:
+            self.unchanged += 1
+        return changed
+
+    def touch(self, url: str, headers: Mapping[str, str]) -> None:
+        """Record a 304 response (servers may send refreshed validators with it)."""
+        self.not_modified += 1
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        if etag or last_modified:
+            self._conn.execute("UPDATE http_cache SET etag = coalesce(?, etag), last_modified = coalesce(?, last_modified), updated = ? WHERE url = ?",
+                               (etag, last_modified, time.time(), url))
+            self._wrote()
+
+    def close(self) -> None:
+        if self.logger:
+            self.logger.info(f"HTTP cache: {self.not_modified} not modified, {self.unchanged} unchanged, {self.changed} new or changed responses.")
+        super().close()
@@ -0,0 +1,250 @@
+"""
+Image post-processing stage
+Saved images are decoded once in a worker process, which writes their thumbnails and computes their perceptual
+hashes (pHash, dHash) for an index, without the crawler ever waiting on it.
+"""
+import os
+import math
+import asyncio
+import multiprocessing
+from uuid import uuid4
+from hashlib import sha256
+from pathlib import Path
+from logging import Logger
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, NamedTuple, Optional
+
+try:
+    from PIL import Image
+except ImportError: # optional, only needed by KahImageProcessor
+    Image = None
+
+from .dcs_sqlite import KahSqliteDb, select_in
+
+THUMBNAIL_SIZES = (128, 512)
+THUMBNAIL_QUALITY = 85
+
+class KahImageInfo(NamedTuple):
+    digest: str # sha256 of the image file
+    width: int
+    height: int
+    phash: str # 64 bits, hex
+    dhash: str # 64 bits, hex
+
+# =======================
+# Worker side
+# =======================
+
+def _bits_to_hex(bits: Iterable[bool]) -> str:
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bit
+    return f"{value:016x}"
+
+def dhash(gray: "Image.Image") -> str:
+    """Difference hash: is each pixel brighter than its right neighbour, on a 9x8 reduction."""
+    pixels = list(gray.resize((9, 8), Image.Resampling.BOX).getdata())
+    return _bits_to_hex(pixels[row * 9 + col] > pixels[row * 9 + col + 1] for row in range(8) for col in range(8))
+
+_DCT_32 = [[math.cos(math.pi * (2 * x + 1) * u / 64) for x in range(32)] for u in range(8)] # first 8 DCT-II bases over 32 samples
+
+def phash(gray: "Image.Image") -> str:
+    """Perceptual hash: is each of the 8x8 lowest frequencies of the DCT of a 32x32 reduction above their median
+    (DC term excluded from the median)."""
+    pixels = list(gray.resize((32, 32), Image.Resampling.BOX).getdata())
+    rows = [[sum(b[x] * pixels[y * 32 + x] for x in range(32)) for b in _DCT_32] for y in range(32)] # 32 rows x 8 freqs
+    coefs = [sum(b[y] * rows[y][u] for y in range(32)) for b in _DCT_32 for u in range(8)] # 8 x 8
+    median = sorted(coefs[1:])[31]
+    return _bits_to_hex(c > median for c in coefs)
+
+def thumbnail_path(root: Path, size: int, digest: str) -> Path:
+    return root / str(size) / digest[:2] / f"{digest}.jpg"
+
+def process_image(path: Path, digest: str, thumbnail_root: Optional[Path], sizes: tuple[int, ...], quality: int) -> KahImageInfo:
+    """Decode the image at path once: write its thumbnails (longest side at most size, largest first, each one
+    reduced from the previous) and hash it. Runs in a worker process."""
+    with Image.open(path) as image:
+        width, height = image.size
+        if sizes:
+            image.draft("RGB", (max(sizes), max(sizes))) # JPEG: decode at the smallest sufficient scale
+        image = image.convert("RGB")
+    if thumbnail_root is not None:
+        thumbnail = image
+        for size in sorted(sizes, reverse=True):
+            thumbnail = thumbnail.copy()
+            thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+            out = thumbnail_path(thumbnail_root, size, digest)
+            out.parent.mkdir(parents=True, exist_ok=True)
+            tmp = out.with_name(f".{out.name}.{uuid4().hex}.tmp")
+            thumbnail.save(tmp, "JPEG", quality=quality)
+            os.replace(tmp, out)
+    gray = image.convert("L")
+    return KahImageInfo(digest, width, height, phash(gray), dhash(gray))
+
+def _file_digest(path: Path) -> str:
+    hasher = sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+# =======================
+# Index
+# =======================
+
+class KahImageIndex(KahSqliteDb):
+    """SQLite tables image name -> digest and digest -> size and perceptual hashes. Writes are committed every
+    commit_every_n marks, every commit_every_ms and on checkpoint()."""
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS images (digest TEXT PRIMARY KEY, width INTEGER NOT NULL, height INTEGER NOT NULL, phash TEXT NOT NULL, dhash TEXT NOT NULL) WITHOUT ROWID",
+              "CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, digest TEXT NOT NULL) WITHOUT ROWID",
+              "CREATE INDEX IF NOT EXISTS images_phash ON images (phash)",
+              "CREATE INDEX IF NOT EXISTS images_dhash ON images (dhash)")
+
+    def get(self, name: str) -> Optional[KahImageInfo]:
+        row = self._conn.execute("SELECT i.digest, width, height, phash, dhash FROM names n JOIN images i ON i.digest = n.digest WHERE n.name = ?", (name,)).fetchone()
+        return KahImageInfo(*row) if row else None
+
+    def has_digest(self, digest: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM images WHERE digest = ?", (digest,)).fetchone() is not None
+
+    def missing(self, names: Iterable[str]) -> set[str]:
+        """Names not processed yet (e.g. dropped while the stage was saturated)."""
+        names = list(names)
+        return set(names).difference(row[0] for row in select_in(self._conn, "SELECT name FROM names WHERE name IN ({})", names))
+
+    def similar(self, phash: str, max_distance: int = 6) -> list[tuple[str, int]]:
+        """(digest, hamming distance) of the images whose pHash is within max_distance bits of phash (full scan)."""
+        target = int(phash, 16)
+        out = [(digest, (int(other, 16) ^ target).bit_count()) for digest, other in self._conn.execute("SELECT digest, phash FROM images")]
+        return sorted((d for d in out if d[1] <= max_distance), key=lambda d: d[1])
+
+    def mark(self, name: str, info: Optional[KahImageInfo] = None, digest: Optional[str] = None) -> None:
+        """Record image name, with its info, or as a copy of an already recorded digest."""
+        if info is not None:
+            self._conn.execute("INSERT OR REPLACE INTO images (digest, width, height, phash, dhash) VALUES (?, ?, ?, ?, ?)", info)
+            digest = info.digest
+        self._conn.execute("INSERT OR REPLACE INTO names (name, digest) VALUES (?, ?)", (name, digest))
+        self._wrote()
+
+# =======================
+# Stage
+# =======================
+
+class KahImageProcessor:
+    """Process saved images (see process_image) in a pool of max_workers processes, recording them in index.
+
+    submit() never waits: while max_queued images are queued or being processed, new ones are dropped (and
+    counted), to be resubmitted later by catch_up(). Images with a digest already in the index are recorded
+    without being processed again. Workers are spawned, not forked (they import the main module again, whose
+    crawl must be under an if __name__ == '__main__' guard). Needs Pillow."""
+
+    def __init__(self,
+                 index: KahImageIndex,
+                 thumbnail_root: Optional[Path] = None,
+                 thumbnail_sizes: tuple[int, ...] = THUMBNAIL_SIZES,
+                 thumbnail_quality: int = THUMBNAIL_QUALITY,
+                 max_workers: Optional[int] = None,
+                 max_queued: int = 256,
+                 logger: Optional[Logger] = None) -> None:
+        if Image is None:
+            raise ImportError("Pillow is required for image processing (pip install Pillow)")
+        self.index = index
+        self.thumbnail_root = thumbnail_root
+        self.thumbnail_sizes = thumbnail_sizes
+        self.thumbnail_quality = thumbnail_quality
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1) # leave a core to the event loop
+        self.max_queued = max_queued
+        self.logger = logger
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: dict[str, list[str]] = {} # digest being processed -> names waiting for it
+        self._futures: set[asyncio.Future] = set()
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending)
+
+    def submit(self, path: Path, name: str, digest: str) -> bool:
+        """Queue the image saved at path as name (digest: sha256 of the file). Return False if dropped."""
+        if digest in self._pending:
+            self._pending[digest].append(name)
+            return True
+        if self.index.has_digest(digest):
+            self.index.mark(name, digest=digest)
+            return True
+        if len(self._pending) >= self.max_queued:
+            self.dropped += 1
+            if self.logger:
+                self.logger.debug(f"Image processing saturated ({self.max_queued} queued), not processing {name}.")
+            return False
+        if self._executor is None: # spawned: forking the crawler, whose threads may hold locks, can deadlock workers
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._pending[digest] = [name]
+        future = asyncio.get_running_loop().run_in_executor(self._executor, process_image, path, digest, self.thumbnail_root,
+                                                            self.thumbnail_sizes, self.thumbnail_quality)
+        self._futures.add(future)
+        future.add_done_callback(lambda f: self._done(digest, f))
+        return True
+
+    def _done(self, digest: str, future: asyncio.Future) -> None:
+        self._futures.discard(future)
+        names = self._pending.pop(digest)
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is not None:
+            self.failed += 1
+            if self.logger:
+                self.logger.warning(f"Cannot process image {names[0]}: {e=}")
+            return
+        self.processed += 1
+        info = future.result()
+        for i, name in enumerate(names):
+            self.index.mark(name, info if i == 0 else None, digest)
+
+    async def catch_up(self, images: Iterable[tuple[Path, str, Optional[str]]], batch_size: int = 500) -> int:
+        """Submit the images (path, name, digest or None) missing from the index (e.g. dropped while saturated),
+        waiting for room in the queue instead of dropping them. Return the number of images submitted."""
+        submitted = 0
+        batch: list[tuple[Path, str, Optional[str]]] = []
+        for image in images:
+            batch.append(image)
+            if len(batch) >= batch_size:
+                submitted += await self._catch_up_batch(batch)
+                batch = []
+        if batch:
+            submitted += await self._catch_up_batch(batch)
+        if self.logger:
+            self.logger.info(f"Image processing catch-up: {submitted} images resubmitted.")
+        return submitted
+
+    async def _catch_up_batch(self, batch: list[tuple[Path, str, Optional[str]]]) -> int:
+        missing = self.index.missing(name for _, name, _ in batch)
+        submitted = 0
+        for path, name, digest in batch:
+            if name not in missing:
+                continue
+            if digest is None:
+                try:
+                    digest = await asyncio.to_thread(_file_digest, path)
+                except OSError as e:
+                    if self.logger:
+                        self.logger.warning(f"Cannot read image {name}: {e=}")
+                    continue
+            while len(self._pending) >= self.max_queued and digest not in self._pending:
+                await asyncio.wait(self._futures, return_when=asyncio.FIRST_COMPLETED)
+            submitted += self.submit(path, name, digest)
+        return submitted
+
+    async def wait_and_close(self) -> None:
+        """Wait for queued images, then stop the workers."""
+        if self._futures:
+            await asyncio.wait(self._futures)
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.index.checkpoint()
+        if self.logger:
+            self.logger.info(f"Image processing: {self.processed} processed, {self.failed} failed, {self.dropped} dropped (saturated).")
@@ -0,0 +1,60 @@
+"""
+JSON parse stage for fetch callbacks
+Bodies are parsed straight from bytes (orjson when installed), large ones in a worker process, and callbacks
+receive the parsed object instead of decoding and parsing on the event loop themselves.
+"""
+import json
+import asyncio
+from functools import wraps
+from logging import Logger
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+
+from .dcs_lib import decode_if_possible
+
+try:
+    import orjson
+except ImportError: # optional, ~1.5x faster than json and no str copy
+    orjson = None
+
+def loads(data: bytes, content_type: Optional[str] = None) -> Any:
+    """Parse json bytes without decoding them first. Non utf-8 payloads fall back to decode_if_possible."""
+    try:
+        return orjson.loads(data) if orjson is not None else json.loads(data)
+    except ValueError: # invalid json or not utf-8 (UnicodeDecodeError is a ValueError)
+        return json.loads(decode_if_possible(data, content_type))
+
+class KahJsonParser:
+    """Parse payloads under offload_min_bytes on the event loop, larger ones in a pool of max_workers processes.
+
+    Threads would not help: json parsers hold the GIL for the whole parse. Getting the result back from a
+    process costs about a parse with orjson, which halves the longest event loop stall on multi-MB pages."""
+
+    def __init__(self, offload_min_bytes: int = 1 << 20, max_workers: int = 1, logger: Optional[Logger] = None) -> None:
+        self.offload_min_bytes = offload_min_bytes
+        self.max_workers = max_workers
+        self.logger = logger
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def parse(self, data: bytes, content_type: Optional[str] = None) -> Any:
+        if len(data) < self.offload_min_bytes:
+            return loads(data, content_type)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        if self.logger:
+            self.logger.debug(f"Parsing {len(data)} bytes of json in a worker process.")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, loads, data, content_type)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+def json_callback(callback, parser: Optional[KahJsonParser] = None):
+    """Wrap callback(fetcher, resp, data, content, **kwargs) as a fetch callback, content being the parsed body."""
+    @wraps(callback)
+    async def wrapper(fetcher, resp, data: bytes, **kwargs):
+        content_type = resp.headers.get("Content-Type")
+        content = await parser.parse(data, content_type) if parser is not None else loads(data, content_type)
+        return await callback(fetcher, resp, data, content, **kwargs)
+    return wrapper
@@ -2,22 +2,84 @@
 Copy of cms_lib.py
 Common utils
 """
+import os
+import time
+import atexit
+import asyncio
+import threading
 import logging
 import aiofiles
+from uuid import uuid4
+from queue import SimpleQueue
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from bs4 import Tag
 from aiohttp import ClientResponse
 from typing import Optional
 
 from .dcs_skip import KahSkipManager
+from .dcs_charset import CHARSETS
+from .dcs_store import KahContentStore, KahBlobWriter
+from .dcs_shard import KahShardedDir
+from .dcs_imgproc import KahImageProcessor
 from .kahscrape.kahscrape import FetcherABC
 
 def redirect_url(url: str) -> str:
     """Replace given url to take into account manually-defined new urls"""
     return url
 
+class KahBatchedFileHandler(logging.FileHandler):
+    """FileHandler flushing every flush_every_n records, every flush_every_ms, for records of flush_level and above,
+    and on close, instead of after every record. A timer thread flushes records left buffered while idle."""
+
+    def __init__(self, path: Path, flush_every_n: int = 256, flush_every_ms: float = 1000.0, flush_level: int = logging.WARNING, encoding: str = "utf-8") -> None:
+        super().__init__(path, encoding=encoding)
+        self.flush_every_n = flush_every_n
+        self.flush_every_ms = flush_every_ms
+        self.flush_level = flush_level
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        self._force_flush = False
+        self._stop_timer = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self._timer is None: # started on first record, called with the handler lock held
+            self._timer = threading.Thread(target=self._timer_loop, name=f"flush-{Path(self.baseFilename).name}", daemon=True)
+            self._timer.start()
+        self._unflushed += 1
+        self._force_flush = record.levelno >= self.flush_level
+        super().emit(record) # calls flush()
+
+    def flush(self) -> None:
+        if self._unflushed >= self.flush_every_n or self._force_flush \
+                or (time.monotonic() - self._last_flush) * 1000.0 >= self.flush_every_ms:
+            self.force_flush()
+
+    def force_flush(self) -> None:
+        super().flush()
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def _timer_loop(self) -> None:
+        while not self._stop_timer.wait(self.flush_every_ms / 1000.0):
+            with self.lock:
+                if self._unflushed and self.stream is not None:
+                    self.flush()
+
+    def close(self) -> None:
+        self._stop_timer.set()
+        if self._timer is not None and self._timer is not threading.current_thread():
+            self._timer.join()
+        self._force_flush = True
+        super().close()
+
 class KahLogger(logging.Logger):
-    """Logger to log to given file and to console. Will add color to console logs."""
+    """Logger to log to given file and to console. Will add color to console logs.
+
+    queued=True: records are put on an in-memory queue and written by a listener thread (file writes batched,
+    see KahBatchedFileHandler), so logging from the event loop never waits on the disk or the terminal.
+    Call close() (also registered atexit, so it runs after the atexit closes registered later) to drain the queue."""
     COLORS = {
         'INFO': '\033[92m',    # Green
         'WARNING': '\033[93m', # Yellow
@@ -31,18 +93,18 @@ class KahLogger(logging.Logger):
         def format(self, record):
             # Set the color based on the log level
             col = KahLogger.COLORS.get(record.levelname, KahLogger.COLORS['RESET'])
-            rst = KahLogger.COLORS.get('RESET')
+            rst = KahLogger.COLORS['RESET']
             log_message = super().format(record)
-            msg_args = log_message.split("\n")
-            # Apply color to "CONSOLE:" prefix
-            return f"{col}{msg_args[0]}{rst}\n{'\n'.join(msg_args[1:])}" if len(msg_args) > 1 else f"{col}{log_message}{rst}"
+            # Apply color to the first line only
+            end = log_message.find("\n")
+            return f"{col}{log_message}{rst}" if end < 0 else f"{col}{log_message[:end]}{rst}{log_message[end:]}"
         
-    def __init__(self, name: str, path: Path, level_file: int = logging.INFO, level_console: int = logging.INFO) -> None:
+    def __init__(self, name: str, path: Path, level_file: int = logging.INFO, level_console: int = logging.INFO, queued: bool = False) -> None:
         super().__init__(name, max(level_console, level_file))
 
         # Create a file handler and set the log level
         path.parent.mkdir(parents=True, exist_ok=True)
-        file_handler = logging.FileHandler(path, encoding="utf-8")
+        file_handler = KahBatchedFileHandler(path) if queued else logging.FileHandler(path, encoding="utf-8")
         file_handler.setLevel(level_file)
         
         # Create a console handler and set the log level
@@ -57,37 +119,87 @@ class KahLogger(logging.Logger):
         console_formatter = KahLogger.ConsoleColorFormatter('%(levelname)s - %(message)s')
         console_handler.setFormatter(console_formatter)
 
-        # Add the handlers to the logger
-        self.addHandler(file_handler)
-        self.addHandler(console_handler)
-
-async def callback_image_save(fetcher: FetcherABC, resp: ClientResponse, data: bytes, logger: KahLogger, save_file_path: Path, skipper: Optional[KahSkipManager] = None):
-    """For cutlist xml pages"""
-    logger.info(f"Successfully fetched image {resp.url} ({len(data)} bytes)")
-    
-    save_file_path.parent.mkdir(parents=True, exist_ok=True)
-    async with aiofiles.open(save_file_path, "wb+") as f:
-        await f.write(data)
-    
-    logger.debug(f"Saved image to {save_file_path}")
+        # Add the handlers to the logger, or to the listener thread behind a queue
+        self._listener: Optional[QueueListener] = None
+        if queued:
+            log_queue = SimpleQueue()
+            self._listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+            self._listener.start()
+            self.addHandler(QueueHandler(log_queue))
+            atexit.register(self.close)
+        else:
+            self.addHandler(file_handler)
+            self.addHandler(console_handler)
+
+    def close(self) -> None:
+        """Write out queued records. Records logged afterwards (e.g. by other atexit closes) are written directly,
+        the handlers being closed by logging at exit."""
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in list(self.handlers):
+                self.removeHandler(handler)
+            for handler in self._listener.handlers:
+                getattr(handler, "force_flush", handler.flush)()
+                self.addHandler(handler)
+            self._listener = None
+
+IMAGE_CHUNK_SIZE = 1 << 16
+
+async def callback_image_save(fetcher: FetcherABC, resp: ClientResponse, data: Optional[bytes], logger: KahLogger, save_file_path: Optional[Path] = None, skipper: Optional[KahSkipManager] = None, store: Optional[KahContentStore] = None, chunk_size: int = IMAGE_CHUNK_SIZE, shards: Optional[KahShardedDir] = None, save_name: Optional[str] = None, processor: Optional[KahImageProcessor] = None):
+    """Save image to save_file_path. If data is None (fetched with stream=True), the body is read from resp in chunk_size chunks.
+    The image is hashed while written to a temp file, fsynced, then renamed into place: save_file_path is never a partial image.
+    If shards is given, the image is saved as save_name in it (see KahShardedDir) instead of to save_file_path.
+    If store is given, identical images are kept once (see KahContentStore).
+    If processor is given, the saved image is queued for thumbnails and perceptual hashes (see KahImageProcessor)."""
+    if shards is not None:
+        save_file_path = shards.path_of(save_name, create=True)
+    if store:
+        writer = store.new_writer()
+    elif shards is not None:
+        writer = shards.new_writer(save_name)
+    else:
+        save_file_path.parent.mkdir(parents=True, exist_ok=True)
+        writer = KahBlobWriter(save_file_path.with_name(f".{save_file_path.name}.{uuid4().hex}.part"))
+    try:
+        async with aiofiles.open(writer.tmp_path, "wb") as f:
+            if data is None:
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    writer.update(chunk)
+                    await f.write(chunk)
+            else:
+                writer.update(data)
+                await f.write(data)
+            await f.flush()
+            await asyncio.to_thread(os.fsync, f.fileno())
+    except BaseException: # connection lost, cancelled, ...: retried from scratch
+        writer.discard()
+        raise
+    logger.info(f"Successfully fetched image {resp.url} ({writer.size} bytes)")
+
+    digest = writer.hasher.hexdigest()
+    if store: # link into the store
+        digest, deduplicated = store.commit(writer, save_file_path)
+        logger.debug(f"Saved image to {save_file_path} (blob {digest}{', deduplicated' if deduplicated else ''})")
+        if shards is not None:
+            shards.record(save_name, writer.size, digest)
+    elif shards is not None:
+        shards.commit(writer, save_name)
+        logger.debug(f"Saved image to {save_file_path}")
+    else:
+        os.replace(writer.tmp_path, save_file_path)
+        logger.debug(f"Saved image to {save_file_path}")
+
+    if processor is not None:
+        processor.submit(save_file_path, save_name or save_file_path.name, digest)
+
     if skipper: # Notify skipper of successful download
         skipper.mark_url_as_downloaded(str(resp.url))
 
-def decode_if_possible(data: bytes) -> str:
-    try:
-        return data.decode('utf-8')
-    except UnicodeDecodeError:
-        try:
-            return data.decode('shift-jis')
-        except UnicodeDecodeError:
-            try:
-                return data.decode('big5')
-            except UnicodeDecodeError:
-                try:
-                    return data.decode('gbk')
-                except UnicodeDecodeError:
-                    pass
-    return str(data)
+def decode_if_possible(data: bytes, content_type: Optional[str] = None, host: Optional[str] = None) -> str:
+    """Decode data with its declared charset, else the last one that worked for host, else utf-8, shift-jis, big5, gbk.
+    See KahCharsetResolver."""
+    text = CHARSETS.decode(data, content_type, host)
+    return text if text is not None else str(data)
 
 def try_find_else_none(content: Tag, name: str) -> str | None:
     tag = content.find(name)
@@ -0,0 +1,220 @@
+"""
+Live crawl metrics
+Counters, histograms and gauges labelled per host / per callback kind, served as Prometheus text on a local HTTP
+endpoint and written periodically as a JSON snapshot.
+"""
+import os
+import json
+import time
+import asyncio
+from bisect import bisect_left
+from pathlib import Path
+from logging import Logger
+from typing import Callable, Iterable, Optional, Union
+from aiohttp import web
+
+Labels = tuple[tuple[str, str], ...]
+GaugeValues = Union[float, Iterable[tuple[dict[str, str], float]]]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _labels(labels: dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class KahHistogram:
+    """Cumulative bucket histogram (Prometheus style), quantiles interpolated within buckets."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one: +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if cumulative + n >= rank and n:
+                if i == len(self.buckets): # +Inf bucket
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+class KahMetrics:
+    """Registry of labelled metrics.
+
+    inc(name, value, **labels): counter
+    observe(name, value, **labels): histogram (seconds by default, see LATENCY_BUCKETS)
+    gauge(name, fn): gauge read when exported, fn() returning a value or (labels, value) pairs"""
+
+    def __init__(self, prefix: str = "kah", buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.prefix = prefix
+        self.buckets = buckets
+        self.started = time.time()
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._histograms: dict[str, dict[Labels, KahHistogram]] = {}
+        self._gauges: dict[str, Callable[[], GaugeValues]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        series = self._counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        series = self._histograms.setdefault(name, {})
+        key = _labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = KahHistogram(self.buckets)
+        histogram.observe(value)
+
+    def gauge(self, name: str, fn: Callable[[], GaugeValues]) -> None:
+        self._gauges[name] = fn
+
+    def counter_value(self, name: str, **labels: str) -> float:
+        return self._counters.get(name, {}).get(_labels(labels), 0.0)
+
+    def _gauge_values(self) -> dict[str, list[tuple[Labels, float]]]:
+        out = {}
+        for name, fn in self._gauges.items():
+            values = fn()
+            if isinstance(values, (int, float)):
+                out[name] = [((), float(values))]
+            else:
+                out[name] = [(_labels(labels), float(value)) for labels, value in values]
+        return out
+
+    # =======================
+    # Export
+    # =======================
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name, series in sorted(self._counters.items()):
+            lines.append(f"# TYPE {self.prefix}_{name} counter")
+            lines.extend(f"{self.prefix}_{name}{_format_labels(labels)} {value:g}" for labels, value in series.items())
+        for name, series in sorted(self._histograms.items()):
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {full} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, n in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += n
+                    le = f'le="{bound}"'
+                    lines.append(f"{full}_bucket{_format_labels(labels, le)} {cumulative}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{full}_count{_format_labels(labels)} {histogram.count}")
+        for name, values in sorted(self._gauge_values().items()):
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.extend(f"{self.prefix}_{name}{_format_labels(labels)} {value:g}" for labels, value in values)
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Json-serializable state: counters, histogram count/sum/p50/p90/p99, gauges."""
+        now = time.time()
+        return {
+            "time": now,
+            "uptime_s": now - self.started,
+            "counters": {name: [{"labels": dict(labels), "value": value} for labels, value in series.items()]
+                         for name, series in self._counters.items()},
+            "histograms": {name: [{"labels": dict(labels), "count": h.count, "sum": h.sum,
+                                   "p50": h.quantile(0.5), "p90": h.quantile(0.9), "p99": h.quantile(0.99)}
+                                  for labels, h in series.items()]
+                           for name, series in self._histograms.items()},
+            "gauges": {name: [{"labels": dict(labels), "value": value} for labels, value in values]
+                       for name, values in self._gauge_values().items()},
+        }
+
+class KahMetricsExporter:
+    """Serve metrics as Prometheus text on http://host:port/metrics (and JSON on /metrics.json), and write a
+    JSON snapshot to path_snapshot every snapshot_every_s seconds (and on stop). port=None: no endpoint, port=0: any
+    free port (logged)."""
+
+    def __init__(self,
+                 metrics: KahMetrics,
+                 host: str = "127.0.0.1",
+                 port: Optional[int] = 9108,
+                 path_snapshot: Optional[Path] = None,
+                 snapshot_every_s: float = 10.0,
+                 logger: Optional[Logger] = None) -> None:
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.path_snapshot = path_snapshot
+        self.snapshot_every_s = snapshot_every_s
+        self.logger = logger
+        self._runner: Optional[web.AppRunner] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+
+    async def _handle_prometheus(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render_prometheus(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def _handle_json(self, request: web.Request) -> web.Response:
+        return web.json_response(self.metrics.snapshot())
+
+    async def start(self) -> None:
+        """Start the snapshots and the endpoint. If the port cannot be bound (e.g. another crawler already
+        serves its metrics there), log a warning and go on without the endpoint."""
+        if self.path_snapshot is not None:
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+        if self.port is not None:
+            app = web.Application()
+            app.router.add_get("/metrics", self._handle_prometheus)
+            app.router.add_get("/metrics.json", self._handle_json)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            try:
+                await web.TCPSite(self._runner, self.host, self.port).start()
+            except OSError as e:
+                await self._runner.cleanup()
+                self._runner = None
+                if self.logger:
+                    self.logger.warning(f"Cannot serve crawl metrics on {self.host}:{self.port}, no endpoint: {e=}")
+                return
+            port = self._runner.addresses[0][1] if self._runner.addresses else self.port # port=0: picked by the OS
+            if self.logger:
+                self.logger.info(f"Serving crawl metrics on http://{self.host}:{port}/metrics")
+
+    def write_snapshot(self) -> None:
+        """Atomically replace path_snapshot with the current snapshot."""
+        self.path_snapshot.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path_snapshot.with_name(f".{self.path_snapshot.name}.tmp")
+        tmp.write_text(json.dumps(self.metrics.snapshot(), ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, self.path_snapshot)
+
+    async def _snapshot_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.snapshot_every_s)
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                if self.logger:
+                    self.logger.warning(f"Cannot write metrics snapshot to {self.path_snapshot}: {e=}")
+
+    async def stop(self) -> None:
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            self._snapshot_task = None
+            self.write_snapshot()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
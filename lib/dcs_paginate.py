@@ -0,0 +1,85 @@
+"""
+Speculative pagination
+Listings are walked without knowing their page count: a window of pages is fetched ahead, and the walk stops at
+the first empty (or repeated) page, cancelling the requests for pages past it.
+"""
+import asyncio
+from logging import Logger
+from typing import Awaitable, Callable, Iterable, Optional
+
+class KahPaginator:
+    """Keep window pages in flight ahead of the last page seen non-empty.
+
+    fetch_page(page) queues a page (e.g. with KahAdaptiveFetcher.fetch) and returns its task, or None.
+    The page callback reports the item keys it found with page_done(page, keys), which returns False for pages
+    past the end: empty, or with the very same items as an earlier page (sites serving the last page again).
+    Requests for pages after the end are then cancelled. max_pages bounds the walk in any case."""
+
+    def __init__(self,
+                 fetch_page: Callable[[int], Awaitable[Optional[asyncio.Task]]],
+                 window: int = 4,
+                 first_page: int = 1,
+                 max_pages: Optional[int] = 10_000,
+                 name: str = "pages",
+                 logger: Optional[Logger] = None) -> None:
+        self.fetch_page = fetch_page
+        self.window = max(1, window)
+        self.first_page = first_page
+        self.max_pages = max_pages
+        self.name = name
+        self.logger = logger
+        self.next_page = first_page # next page to queue
+        self.end_page: Optional[int] = None # first page past the end, once known
+        self.tasks: dict[int, asyncio.Task] = {}
+        self._seen: dict[frozenset[str], int] = {} # page items -> first page with them
+
+    async def start(self) -> None:
+        await self._fill(self.first_page + self.window)
+
+    def track(self, page: int, task: Optional[asyncio.Task]) -> None:
+        """Account for a page queued outside of the paginator (e.g. resumed from a frontier)."""
+        if task is not None:
+            self.tasks[page] = task
+        self.next_page = max(self.next_page, page + 1)
+
+    async def _fill(self, up_to: int) -> None:
+        """Queue pages up to (excluded) up_to."""
+        if self.max_pages is not None:
+            up_to = min(up_to, self.first_page + self.max_pages)
+        while self.next_page < up_to and (self.end_page is None or self.next_page < self.end_page):
+            page = self.next_page
+            self.next_page += 1
+            task = await self.fetch_page(page)
+            if task is not None and not task.done():
+                self.tasks[page] = task
+
+    async def page_done(self, page: int, keys: Iterable[str], is_last: bool = False) -> bool:
+        """Report the item keys of page (is_last: the page is known to be the last one, e.g. a short page).
+        Return False if page is past the end, i.e. its items are not to be processed."""
+        self.tasks.pop(page, None)
+        if self.end_page is not None and page >= self.end_page:
+            return False
+        keys = frozenset(keys)
+        if not keys:
+            self._end(page, "empty")
+            return False
+        first_page = self._seen.setdefault(keys, page)
+        if first_page != page:
+            self._end(page, f"same items as page {first_page}")
+            return False
+        if is_last:
+            self._end(page + 1, f"page {page} is the last one")
+        else:
+            await self._fill(page + 1 + self.window)
+        return True
+
+    def _end(self, page: int, reason: str) -> None:
+        """Pages from page on are past the end: cancel their requests."""
+        if self.end_page is not None and self.end_page <= page:
+            return
+        self.end_page = page
+        cancelled = [p for p in self.tasks if p >= page]
+        for p in cancelled:
+            self.tasks.pop(p).cancel()
+        if self.logger:
+            self.logger.info(f"End of {self.name} at page {page} ({reason}), {len(cancelled)} speculative requests cancelled.")
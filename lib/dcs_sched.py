@@ -0,0 +1,176 @@
+"""
+Bounded priority scheduling of fetches
+Queued urls are split into named priority classes (e.g. discovery > item metadata > images) sharing a fixed number
+of running slots by weight, each class admitting a bounded number of queued urls so producers wait instead of
+piling up work in memory.
+"""
+import asyncio
+from collections import deque
+from logging import Logger
+from typing import Optional
+
+class KahPriorityClass:
+    """Priority class of queued urls.
+
+    name: class name, passed as fetch(..., priority=name)
+    weight: share of the running slots when several classes have waiting urls
+    max_queued: bound on admitted urls waiting for a slot; producers wait in admit() beyond it"""
+
+    def __init__(self, name: str, weight: float = 1.0, max_queued: int = 1024) -> None:
+        self.name = name
+        self.weight = weight
+        self.max_queued = max(1, max_queued)
+
+class _ClassState:
+    def __init__(self, cls: KahPriorityClass, rank: int) -> None:
+        self.cls = cls
+        self.rank = rank # tie breaker: earlier classes first
+        self.queued = 0 # admitted, not dispatched yet
+        self.pass_ = 0.0 # stride scheduling virtual time
+        self.waiters: deque[tuple[asyncio.Future, bool]] = deque() # (future, admitted) waiting for a slot
+        self.admit_waiters: deque[asyncio.Future] = deque()
+        self.blocked = 0 # producers waiting in admit()
+
+class KahPriorityScheduler:
+    """Weighted fair sharing of max_running slots between priority classes (stride scheduling: each dispatch
+    advances the class virtual time by 1 / weight, the class with the lowest one goes next, ties going to
+    the class listed first).
+
+    Producers call admit(name) before queueing a url (waits while the class already has max_queued urls
+    waiting), the url's task then holds a slot between acquire(name) and release().
+    A slot holder blocked in admit() (a callback queueing the urls it discovered) gives its slot back while
+    it waits, and classes with blocked producers are dispatched first, so full queues always drain."""
+
+    def __init__(self, classes: list[KahPriorityClass], max_running: int = 32, default_class: Optional[str] = None,
+                 logger: Optional[Logger] = None) -> None:
+        if not classes:
+            raise ValueError("At least one priority class is required.")
+        self.classes = {cls.name: _ClassState(cls, rank) for rank, cls in enumerate(classes)}
+        self.max_running = max(1, max_running)
+        self.default_class = default_class or classes[-1].name
+        self.logger = logger
+        self.running = 0
+        self.closed = False
+        self._vtime = 0.0
+        self._holders: set[asyncio.Task] = set()
+
+    def _state(self, name: Optional[str]) -> _ClassState:
+        state = self.classes.get(name or self.default_class)
+        if state is None:
+            raise KeyError(f"Unknown priority class: {name}")
+        return state
+
+    # =======================
+    # Admission (backpressure)
+    # =======================
+
+    async def admit(self, name: Optional[str] = None) -> bool:
+        """Reserve a queue place in class name, waiting while it is full. Return False once closed."""
+        state = self._state(name)
+        if state.queued >= state.cls.max_queued and not self.closed:
+            holder = asyncio.current_task() in self._holders
+            if holder:
+                self.running -= 1
+            state.blocked += 1
+            self._dispatch()
+            try:
+                while state.queued >= state.cls.max_queued and not self.closed:
+                    future = asyncio.get_running_loop().create_future()
+                    state.admit_waiters.append(future)
+                    try:
+                        await future
+                    finally:
+                        if not future.done():
+                            state.admit_waiters.remove(future)
+            finally:
+                state.blocked -= 1
+                if holder:
+                    self.running += 1 # may exceed max_running until released
+        if self.closed:
+            return False
+        state.queued += 1
+        return True
+
+    def _unqueue(self, state: _ClassState) -> None:
+        state.queued -= 1
+        while state.admit_waiters:
+            future = state.admit_waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                break
+
+    # =======================
+    # Slots
+    # =======================
+
+    async def acquire(self, name: Optional[str] = None, admitted: bool = True) -> None:
+        """Wait for a running slot in class name. admitted: the caller holds a place reserved by admit()
+        (False for retries of an already started url)."""
+        state = self._state(name)
+        if not state.waiters:
+            state.pass_ = max(state.pass_, self._vtime) # no credit for idle time
+        future = asyncio.get_running_loop().create_future()
+        state.waiters.append((future, admitted))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled(): # dispatched, then cancelled before running
+                self.running -= 1
+                self._dispatch()
+            else:
+                if (future, admitted) in state.waiters:
+                    state.waiters.remove((future, admitted))
+                if admitted:
+                    self._unqueue(state)
+            raise
+        self._holders.add(asyncio.current_task())
+
+    def release(self) -> None:
+        """Give back the slot held by the current task, if any."""
+        task = asyncio.current_task()
+        if task not in self._holders:
+            return
+        self._holders.discard(task)
+        self.running -= 1
+        self._dispatch()
+
+    def _next_class(self) -> Optional[_ClassState]:
+        candidates = [state for state in self.classes.values() if state.waiters]
+        blocked = [state for state in candidates if state.blocked]
+        candidates = blocked or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=lambda state: (state.pass_, state.rank))
+
+    def _dispatch(self) -> None:
+        while self.running < self.max_running:
+            state = self._next_class()
+            if state is None:
+                return
+            future, admitted = state.waiters.popleft()
+            if future.done():
+                continue
+            self.running += 1
+            self._vtime = state.pass_
+            state.pass_ += 1.0 / state.cls.weight
+            if admitted:
+                self._unqueue(state)
+            future.set_result(None)
+
+    # =======================
+    # State
+    # =======================
+
+    def stats(self) -> dict[str, tuple[int, int]]:
+        """name -> (queued, waiting for a slot)"""
+        return {name: (state.queued, len(state.waiters)) for name, state in self.classes.items()}
+
+    def close(self) -> None:
+        """Refuse new urls: producers waiting in admit() get False."""
+        self.closed = True
+        for state in self.classes.values():
+            while state.admit_waiters:
+                future = state.admit_waiters.popleft()
+                if not future.done():
+                    future.set_result(None)
@@ -0,0 +1,174 @@
+"""
+Sharded file directories
+Files are spread over hash-prefix subdirectories instead of one flat directory of hundreds of thousands of files,
+and a manifest (name -> relative path, size, digest) answers lookups and listings without touching the filesystem.
+"""
+import os
+from uuid import uuid4
+from hashlib import blake2b, sha256
+from pathlib import Path
+from logging import Logger
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from .dcs_store import KahBlobWriter
+from .dcs_sqlite import KahSqliteDb
+
+MANIFEST_NAME = "manifest.sqlite3"
+
+class KahShardEntry(NamedTuple):
+    name: str
+    path: str # relative to the directory root, posix
+    size: int
+    digest: Optional[str] # sha256, None if unknown
+
+class KahShardedDir(KahSqliteDb):
+    """Directory storing file name under root/<h[:width]>/.../name, h being a hash of name, depth levels deep
+    (default: 256 subdirectories, i.e. ~4k files each for a million files).
+    The manifest (root/manifest.sqlite3) records each file written through the directory. Writes are committed
+    every commit_every_n records, every commit_every_ms and on checkpoint().
+
+    Usage, hashing while writing (or put_bytes):
+        writer = shards.new_writer(name)
+        with open(writer.tmp_path, "wb") as f:
+            f.write(chunk); writer.update(chunk)
+        shards.commit(writer, name)"""
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, digest TEXT) WITHOUT ROWID",
+              "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID")
+
+    def __init__(self,
+                 root: Path,
+                 depth: int = 1,
+                 width: int = 2,
+                 commit_every_n: int = 256,
+                 commit_every_ms: float = 1000.0,
+                 logger: Optional[Logger] = None) -> None:
+        self.root = root
+        self.depth = depth
+        self.width = width
+        super().__init__(root / MANIFEST_NAME, commit_every_n, commit_every_ms, logger)
+        layout = f"{depth}x{width}"
+        stored = self._conn.execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+        if stored is None:
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('layout', ?)", (layout,))
+            self._conn.commit()
+        elif stored[0] != layout:
+            self._conn.close()
+            raise ValueError(f"{root} is sharded {stored[0]} (depth x width), not {layout}.")
+        self._made_dirs: set[Path] = set()
+
+    # =======================
+    # Paths
+    # =======================
+
+    def relative_path_of(self, name: str) -> str:
+        h = blake2b(name.encode("utf-8"), digest_size=8).hexdigest()
+        return "/".join([h[i * self.width:(i + 1) * self.width] for i in range(self.depth)] + [name])
+
+    def path_of(self, name: str, create: bool = False) -> Path:
+        """Where file name is (to be) stored. create: make its shard directory."""
+        path = self.root / self.relative_path_of(name)
+        if create and path.parent not in self._made_dirs:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._made_dirs.add(path.parent)
+        return path
+
+    # =======================
+    # Lookup
+    # =======================
+
+    def lookup(self, name: str) -> Optional[KahShardEntry]:
+        row = self._conn.execute("SELECT name, path, size, digest FROM files WHERE name = ?", (name,)).fetchone()
+        return KahShardEntry(*row) if row else None
+
+    def __contains__(self, name: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM files WHERE name = ?", (name,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def entries(self, pattern: Optional[str] = None, batch_size: int = 1000) -> Iterator[KahShardEntry]:
+        """Entries by name, optionally matching glob pattern (e.g. "*.html"). Files may be written meanwhile."""
+        last = ""
+        query = "SELECT name, path, size, digest FROM files WHERE name > ?" + (" AND name GLOB ?" if pattern else "") + " ORDER BY name LIMIT ?"
+        while True:
+            rows = self._conn.execute(query, (last, pattern, batch_size) if pattern else (last, batch_size)).fetchall()
+            yield from (KahShardEntry(*row) for row in rows)
+            if len(rows) < batch_size:
+                return
+            last = rows[-1][0]
+
+    def __iter__(self) -> Iterator[KahShardEntry]:
+        return self.entries()
+
+    def absolute(self, entry: KahShardEntry) -> Path:
+        return self.root / entry.path
+
+    # =======================
+    # Writing
+    # =======================
+
+    def record(self, name: str, size: int, digest: Optional[str] = None) -> None:
+        """Record file name, written to path_of(name) by the caller."""
+        self._conn.execute("INSERT OR REPLACE INTO files (name, path, size, digest) VALUES (?, ?, ?, ?)",
+                           (name, self.relative_path_of(name), size, digest))
+        self._wrote()
+
+    def remove(self, name: str) -> None:
+        self.path_of(name).unlink(missing_ok=True)
+        self._conn.execute("DELETE FROM files WHERE name = ?", (name,))
+        self._wrote()
+
+    def new_writer(self, name: str) -> KahBlobWriter:
+        path = self.path_of(name, create=True)
+        return KahBlobWriter(path.with_name(f".{path.name}.{uuid4().hex}.part"))
+
+    def commit(self, writer: KahBlobWriter, name: str) -> Path:
+        """Move the written temp file into place and record it. Return its path."""
+        path = self.path_of(name)
+        os.replace(writer.tmp_path, path)
+        self.record(name, writer.size, writer.hasher.hexdigest())
+        return path
+
+    def put_bytes(self, name: str, data: bytes) -> Path:
+        """Atomically write data as file name. Return its path."""
+        writer = self.new_writer(name)
+        try:
+            with open(writer.tmp_path, "wb") as f:
+                f.write(data)
+        except BaseException:
+            writer.discard()
+            raise
+        writer.update(data)
+        return self.commit(writer, name)
+
+    # =======================
+    # Migration
+    # =======================
+
+    def import_flat(self, flat_dir: Path, pattern: str = "*", on_move: Optional[Callable[[Path, Path], None]] = None) -> int:
+        """Move the files directly in flat_dir (which may be root itself) into their shards, hashing them for the
+        manifest. Interrupted imports resume where they stopped. on_move(old_path, new_path) is called after each
+        move (e.g. to update another index). Return the number of files moved."""
+        moved = 0
+        with os.scandir(flat_dir) as it:
+            for entry in it:
+                if not entry.is_file(follow_symlinks=False) or entry.name.startswith(MANIFEST_NAME) \
+                        or entry.name.startswith(".") or not Path(entry.name).match(pattern):
+                    continue
+                size = entry.stat(follow_symlinks=False).st_size
+                hasher = sha256()
+                with open(entry.path, "rb") as f:
+                    while chunk := f.read(1 << 20):
+                        hasher.update(chunk)
+                old_path, new_path = Path(entry.path), self.path_of(entry.name, create=True)
+                os.replace(old_path, new_path) # same filesystem: rename, hardlinks kept
+                self.record(entry.name, size, hasher.hexdigest())
+                if on_move is not None:
+                    on_move(old_path, new_path)
+                moved += 1
+                if self.logger and moved % 10_000 == 0:
+                    self.logger.info(f"Moved {moved} files from {flat_dir} into {self.root}...")
+        self.checkpoint()
+        if self.logger:
+            self.logger.info(f"Moved {moved} files from {flat_dir} into {self.root}.")
+        return moved
@@ -3,10 +3,71 @@ Copy of cms_skip.py
 Decides whether the url should be skipped
 """
 import re
+import json
 import atexit
 from pathlib import Path
 from logging import Logger
-from typing import Optional
+from urllib.parse import urlsplit
+from typing import Iterable, Optional
+
+from .dcs_url import KahUrlCanonicalizer
+from .dcs_skip_index import KahSkipIndexABC, KahMemorySkipIndex, KahFingerprintSkipIndex, KahSegmentedSkipIndex, KahSqliteSkipIndex
+
+SKIP_INDEX_BACKENDS = ("memory", "fingerprint", "segmented", "sqlite") # see KahSkipManager
+
+class KahSkipRules:
+    """Blacklist rules loaded from a json file, compiled once.
+
+    File format (every key optional, reason optional):
+        {
+            "hosts": [{"host": "example.com", "reason": "..."}],     # host and all its subdomains
+            "prefixes": [{"prefix": "https://example.com/dead/"}],  # url prefix, case-sensitive
+            "regexes": [{"pattern": "https://i[0-9]\\.example\\.net/"}]  # re.search, case-insensitive
+        }
+    Hosts go to a dict looked up for each parent domain of the url host, prefixes to one str.startswith
+    tuple and regexes to a single alternation of named groups (patterns must not use numbered backrefs)."""
+    DEFAULT_REASON = "Blacklisted (skip rule)."
+
+    def __init__(self, hosts: Optional[dict[str, str]] = None, prefixes: Optional[dict[str, str]] = None, regexes: Optional[dict[str, str]] = None) -> None:
+        self.hosts = {host.lower().strip("."): reason for host, reason in (hosts or {}).items()}
+        self.prefixes = dict(prefixes or {})
+        self._prefix_tuple = tuple(self.prefixes)
+        self.regexes = dict(regexes or {})
+        self._regex_reasons = list(self.regexes.values())
+        self._regex = re.compile("|".join(f"(?P<r{i}>{pattern})" for i, pattern in enumerate(self.regexes)), re.IGNORECASE) if self.regexes else None
+
+    @classmethod
+    def from_file(cls, path: Path) -> "KahSkipRules":
+        """Load rules from a json file (see class doc). A missing file gives no rules."""
+        if not path.exists():
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        default = config.get("default_reason", cls.DEFAULT_REASON)
+        return cls(
+            hosts={rule["host"]: rule.get("reason", default) for rule in config.get("hosts", [])},
+            prefixes={rule["prefix"]: rule.get("reason", default) for rule in config.get("prefixes", [])},
+            regexes={rule["pattern"]: rule.get("reason", default) for rule in config.get("regexes", [])},
+        )
+
+    def match(self, url: str) -> str | None:
+        """If url matches a rule, return its reason else None"""
+        if self.hosts:
+            host = urlsplit(url).hostname or ""
+            while host:
+                reason = self.hosts.get(host)
+                if reason is not None:
+                    return reason
+                _, _, host = host.partition(".")
+        if self._prefix_tuple and url.startswith(self._prefix_tuple):
+            for prefix, reason in self.prefixes.items():
+                if url.startswith(prefix):
+                    return reason
+        if self._regex is not None:
+            m = self._regex.search(url)
+            if m:
+                return self._regex_reasons[int(m.lastgroup[1:])]
+        return None
 
 class KahSkipManager:
     """Skip fetching urls given some criteria"""
@@ -14,15 +75,29 @@ class KahSkipManager:
     # Skip logic
     # =======================    
 
+    def canonicalize(self, url: str) -> str:
+        """Canonical form of url (identity if no canonicalizer is set)"""
+        return self.canonicalizer(url) if self.canonicalizer else url
+
     def should_skip_url(self, url: str) -> str | None:
         """If url should be skipped, return reason else None"""
-        if url in self.downloaded_urls:
+        canonical_url = self.canonicalize(url)
+        self.lookups += 1
+        if canonical_url in self.index or (canonical_url != url and url in self.index): # also check legacy, non-canonical entries
+            self.hits += 1
             return "Already downloaded."
-        # Other
-        if re.search(r'https://i\d\.secure\.pixiv\.net/', url, re.IGNORECASE):
-            return "Blacklisted domain (known dead)."
-        
-        return None
+        return self.rules.match(canonical_url)
+
+    def should_skip_urls(self, urls: Iterable[str]) -> dict[str, str | None]:
+        """Batch should_skip_url: map each canonical url (deduplicated) to its skip reason or None, in input order"""
+        canonical_urls = {self.canonicalize(url): url for url in urls} # canonical -> original
+        downloaded = self.index.contains_many(canonical_urls)
+        legacy = [url for canonical_url, url in canonical_urls.items() if canonical_url != url and canonical_url not in downloaded]
+        downloaded_legacy = self.index.contains_many(legacy) if legacy else set() # legacy, non-canonical entries
+        self.lookups += len(canonical_urls)
+        self.hits += len(downloaded) + len(downloaded_legacy)
+        return {canonical_url: "Already downloaded." if canonical_url in downloaded or url in downloaded_legacy else self.rules.match(canonical_url)
+                for canonical_url, url in canonical_urls.items()}
 
     # =======================
     # Downloaded index
@@ -31,42 +106,69 @@ class KahSkipManager:
     def __init__(self, 
                  path_index: Path = Path(__file__).parent / "downloaded_index.txt", 
                  save_at_exit: bool = True,
-                 logger: Optional[Logger] = None) -> None:
-        """Skip fetching urls given some criteria"""
+                 logger: Optional[Logger] = None,
+                 flush_every_n: int = 64,
+                 flush_every_ms: Optional[float] = 1000.0,
+                 fsync: bool = False,
+                 index: Optional[KahSkipIndexABC] = None,
+                 compact: bool = False,
+                 backend: Optional[str] = None,
+                 path_rules: Path = Path(__file__).parent / "skip_rules.json",
+                 canonicalizer: Optional[KahUrlCanonicalizer] = None) -> None:
+        """Skip fetching urls given some criteria
+
+        index is the storage backend (see dcs_skip_index). If not given, backend picks it:
+            "memory" (default): KahMemorySkipIndex on path_index
+            "fingerprint" (or compact=True): KahFingerprintSkipIndex on path_index
+            "segmented": KahSegmentedSkipIndex in directory path_index without its suffix
+            "sqlite": KahSqliteSkipIndex at path_index with suffix .sqlite3, shared with other crawler processes
+        The last two import the text index at path_index once. flush_every_n, flush_every_ms and fsync are the
+        durability policy of the append logs. Blacklist rules are loaded from path_rules (see KahSkipRules).
+        If canonicalizer is set, urls are canonicalized before any lookup or mark, so equivalent urls dedupe."""
         self.path_index = path_index
-        self.downloaded_urls = set()
         self.logger = logger
-        if save_at_exit:
-            if self.logger:
-                self.logger.debug("Registering atexit save for downloaded urls.")
-            atexit.register(self.save_downloaded_urls)
+        self.canonicalizer = canonicalizer
+        self.rules = KahSkipRules.from_file(path_rules)
+        self.lookups = 0 # urls checked against the downloaded index
+        self.hits = 0 # of which already downloaded
 
-        # Load it if exists
-        if self.path_index.exists():
+        if index is None:
             if self.logger:
                 self.logger.debug(f"Loading downloaded urls from index file at path={self.path_index}.")
-            with open(self.path_index, "r", encoding="utf-8") as f:
-                self.downloaded_urls = set(f.read().splitlines())
-        else: # create
+            backend = backend or ("fingerprint" if compact else "memory")
+            if backend == "memory":
+                index = KahMemorySkipIndex(path_index, flush_every_n, flush_every_ms, fsync, logger=logger)
+            elif backend == "fingerprint":
+                index = KahFingerprintSkipIndex(path_index, flush_every_n, flush_every_ms, fsync, logger=logger)
+            elif backend == "segmented":
+                index = KahSegmentedSkipIndex(path_index.with_suffix(""), path_import=path_index, flush_every_n=flush_every_n,
+                                              flush_every_ms=flush_every_ms, fsync=fsync, logger=logger)
+            elif backend == "sqlite":
+                index = KahSqliteSkipIndex(path_index.with_suffix(".sqlite3"), path_import=path_index, shared=True, logger=logger)
+            else:
+                raise ValueError(f"Unknown skip index backend: {backend} (expected one of {SKIP_INDEX_BACKENDS})")
+        self.index = index
+
+        if save_at_exit:
             if self.logger:
-                self.logger.debug(f"Creating new downloaded urls index file at path={self.path_index}.")
-            self.path_index.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.path_index, "w+", encoding="utf-8") as f:
-                f.write("")
+                self.logger.debug("Registering atexit close of downloaded urls index.")
+            atexit.register(self.close)
 
     def mark_url_as_downloaded(self, url: str) -> None:
         """Mark a URL as downloaded."""
+        url = self.canonicalize(url)
         if self.logger:
             self.logger.debug(f"Marking URL as downloaded: url={url}")
-        self.downloaded_urls.add(url)
-        with open(self.path_index, "a+", encoding="utf-8") as f:
-            f.write(url + "\n")
+        self.index.add(url)
+
+    def flush(self) -> None:
+        """Write pending marks to the index."""
+        self.index.flush()
 
     def save_downloaded_urls(self) -> None:
-        """Save the downloaded URLs to the index file."""
-        if self.logger:
-            self.logger.info(f"Saving downloaded URLs to index file at path={self.path_index}.")
-        self.path_index.parent.mkdir(parents=True, exist_ok=True)
-        with open(self.path_index, "w", encoding="utf-8") as f:
-            f.writelines(url + "\n" for url in sorted(self.downloaded_urls))
+        """Rewrite the whole index compactly (sorted, deduplicated). O(total urls)."""
+        self.index.save()
 
+    def close(self) -> None:
+        """Write pending marks and close the index. O(pending marks), registered at exit if save_at_exit."""
+        self.index.close()
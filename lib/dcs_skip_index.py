@@ -0,0 +1,676 @@
+"""
+Storage backends for KahSkipManager's downloaded url index
+"""
+import sys
+import json
+import heapq
+import sqlite3
+import threading
+from math import exp
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+from abc import ABC, abstractmethod
+from pathlib import Path
+from logging import Logger
+from typing import Iterable, Iterator, Optional
+
+from .dcs_appendlog import KahAppendLog, atomic_write_lines
+from .dcs_sqlite import connect, select_in
+
+class KahSkipIndexABC(ABC):
+    """Set of already downloaded urls."""
+
+    @abstractmethod
+    def __contains__(self, url: str) -> bool:
+        """Whether url was marked as downloaded."""
+
+    @abstractmethod
+    def add(self, url: str) -> None:
+        """Mark url as downloaded."""
+
+    @abstractmethod
+    def __iter__(self) -> Iterator[str]:
+        """Iterate all marked urls."""
+
+    def contains_many(self, urls: Iterable[str]) -> set[str]:
+        """Return the subset of urls that were marked as downloaded."""
+        return {url for url in urls if url in self}
+
+    def flush(self) -> None:
+        """Make pending marks durable."""
+
+    def save(self) -> None:
+        """Rewrite the index compactly. May be O(total urls): not meant to run at exit, use close()."""
+        self.flush()
+
+    def close(self) -> None:
+        """Persist and release resources."""
+        self.flush()
+
+# =======================
+# In-memory set
+# =======================
+
+class KahMemorySkipIndex(KahSkipIndexABC):
+    """Whole index held in a python set, persisted to a text file (one url per line)."""
+
+    def __init__(self,
+                 path_index: Path,
+                 flush_every_n: int = 64,
+                 flush_every_ms: Optional[float] = 1000.0,
+                 fsync: bool = False,
+                 logger: Optional[Logger] = None) -> None:
+        self.path_index = path_index
+        self.logger = logger
+        self.urls: set[str] = set(KahAppendLog.read_lines(path_index))
+        if self.logger:
+            self.logger.debug(f"Loaded {len(self.urls)} downloaded urls from index file at path={self.path_index}.")
+        self._log = KahAppendLog(path_index, flush_every_n, flush_every_ms, fsync, logger=logger)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.urls
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.urls)
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def add(self, url: str) -> None:
+        if url in self.urls:
+            return
+        self.urls.add(url)
+        self._log.append(url)
+
+    def flush(self) -> None:
+        self._log.flush()
+
+    def save(self) -> None:
+        """Rewrite the index file sorted and deduplicated."""
+        if self.logger:
+            self.logger.info(f"Saving downloaded URLs to index file at path={self.path_index}.")
+        self._log.rewrite(sorted(self.urls))
+
+    def close(self) -> None:
+        self._log.close()
+
+# =======================
+# Log-structured segments
+# =======================
+
+class KahSegmentedSkipIndex(KahSkipIndexABC):
+    """Index held in a python set, persisted as a log-structured directory:
+
+        MANIFEST              json list of live files, replaced atomically: the only source of truth
+        snapshot-<id>.txt     immutable, sorted and deduplicated
+        segment-<id>.log      append-only; the last one is active, the others are immutable
+
+    The active segment is rolled once it holds segment_max_lines marks. A background thread merges
+    the snapshot and the immutable segments into a new snapshot once there are compact_min_segments
+    of them; files are only deleted after the new MANIFEST is in place, and unlisted files are
+    garbage-collected on open. Closing only flushes the active segment: O(pending marks).
+
+    If path_import (a legacy text index) exists and the directory has no MANIFEST yet, it is copied
+    in as the first immutable segment."""
+    MANIFEST = "MANIFEST"
+
+    def __init__(self,
+                 path_dir: Path,
+                 path_import: Optional[Path] = None,
+                 flush_every_n: int = 64,
+                 flush_every_ms: Optional[float] = 1000.0,
+                 fsync: bool = False,
+                 segment_max_lines: int = 100_000,
+                 compact_min_segments: int = 4,
+                 compact_interval_s: float = 30.0,
+                 logger: Optional[Logger] = None) -> None:
+        self.path_dir = path_dir
+        self.flush_every_n = flush_every_n
+        self.flush_every_ms = flush_every_ms
+        self.fsync = fsync
+        self.segment_max_lines = segment_max_lines
+        self.compact_min_segments = max(1, compact_min_segments)
+        self.compact_interval_s = compact_interval_s
+        self.logger = logger
+
+        self._lock = threading.RLock()  # guards the manifest state and the active segment
+        self._compact_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+
+        self.path_dir.mkdir(parents=True, exist_ok=True)
+        if not (self.path_dir / self.MANIFEST).exists():
+            self._create(path_import)
+        self._read_manifest()
+        self._collect_garbage()
+
+        self.urls: set[str] = set()
+        for name in self._live_files():
+            self.urls.update(KahAppendLog.read_lines(self.path_dir / name))
+        if self.logger:
+            self.logger.debug(f"Loaded {len(self.urls)} downloaded urls from segmented index at path={self.path_dir}.")
+
+        self._active_lines = 0
+        self._open_active()
+        self._compactor = threading.Thread(target=self._compact_loop, name=f"KahSegmentedSkipIndex({self.path_dir.name})", daemon=True)
+        self._compactor.start()
+
+    # =======================
+    # Manifest
+    # =======================
+
+    def _create(self, path_import: Optional[Path]) -> None:
+        self.snapshot: Optional[str] = None
+        self.segments: list[str] = []
+        self.next_id = 1
+        if path_import is not None and path_import.exists():
+            if self.logger:
+                self.logger.info(f"Importing text index at path={path_import} into segmented index at path={self.path_dir}.")
+            name = self._new_name("segment", ".log")
+            atomic_write_lines(self.path_dir / name, KahAppendLog.read_lines(path_import))
+            self.segments.append(name)
+        self.segments.append(self._new_name("segment", ".log"))  # active
+        self._write_manifest()
+
+    def _new_name(self, kind: str, ext: str) -> str:
+        name = f"{kind}-{self.next_id:06d}{ext}"
+        self.next_id += 1
+        return name
+
+    def _read_manifest(self) -> None:
+        with open(self.path_dir / self.MANIFEST, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.snapshot = manifest["snapshot"]
+        self.segments = manifest["segments"]
+        self.next_id = manifest["next_id"]
+
+    def _write_manifest(self) -> None:
+        manifest = {"snapshot": self.snapshot, "segments": self.segments, "next_id": self.next_id}
+        atomic_write_lines(self.path_dir / self.MANIFEST, [json.dumps(manifest)])
+
+    def _live_files(self) -> list[str]:
+        return ([self.snapshot] if self.snapshot else []) + self.segments
+
+    def _collect_garbage(self) -> None:
+        live = set(self._live_files()) | {self.MANIFEST}
+        for path in self.path_dir.iterdir():
+            if path.name not in live and path.name.startswith(("segment-", "snapshot-", self.MANIFEST)):
+                if self.logger:
+                    self.logger.debug(f"Removing stale index file at path={path}.")
+                path.unlink()
+
+    # =======================
+    # Active segment
+    # =======================
+
+    def _open_active(self) -> None:
+        self._log = KahAppendLog(self.path_dir / self.segments[-1], self.flush_every_n, self.flush_every_ms,
+                                 self.fsync, close_at_exit=False, logger=self.logger)
+
+    def _roll_locked(self) -> None:
+        """Close the active segment, making it immutable, and start a new one."""
+        self._log.close()
+        self.segments.append(self._new_name("segment", ".log"))
+        self._write_manifest()
+        self._active_lines = 0
+        self._open_active()
+        if len(self.segments) - 1 >= self.compact_min_segments:
+            self._wakeup.set()
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.urls
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.urls)
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def add(self, url: str) -> None:
+        if url in self.urls:
+            return
+        self.urls.add(url)
+        with self._lock:
+            self._log.append(url)
+            self._active_lines += 1
+            if self._active_lines >= self.segment_max_lines:
+                self._roll_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._log.flush()
+
+    def save(self) -> None:
+        """Roll the active segment and compact everything into one snapshot, synchronously."""
+        with self._lock:
+            self._roll_locked()
+        self.compact()
+
+    def close(self) -> None:
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wakeup.set()
+        with self._lock:
+            self._log.close()
+        # a compaction in progress is abandoned safely: it only becomes visible through the MANIFEST
+        self._compactor.join(timeout=1.0)
+
+    # =======================
+    # Compaction
+    # =======================
+
+    def _compact_loop(self) -> None:
+        while not self._closed.is_set():
+            self._wakeup.wait(self.compact_interval_s)
+            self._wakeup.clear()
+            if self._closed.is_set():
+                return
+            if len(self.segments) - 1 >= self.compact_min_segments:
+                try:
+                    self.compact()
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"Compaction of segmented index at path={self.path_dir} failed: {e=}")
+
+    def compact(self) -> None:
+        """Merge the snapshot and all immutable segments into a new snapshot."""
+        with self._compact_lock:
+            with self._lock:
+                snapshot, immutable = self.snapshot, self.segments[:-1]
+                if not immutable:
+                    return
+                new_snapshot = self._new_name("snapshot", ".txt")
+            if self.logger:
+                self.logger.info(f"Compacting {len(immutable)} segments into {new_snapshot} at path={self.path_dir}.")
+
+            runs = [sorted(set(KahAppendLog.read_lines(self.path_dir / name))) for name in immutable]
+            if snapshot:
+                runs.append(KahAppendLog.read_lines(self.path_dir / snapshot))  # already sorted, streamed
+            def merged() -> Iterator[str]:
+                last = None
+                for url in heapq.merge(*runs):
+                    if url != last:
+                        if self._closed.is_set():
+                            raise InterruptedError("Index closed during compaction.")
+                        yield url
+                        last = url
+            try:
+                atomic_write_lines(self.path_dir / new_snapshot, merged())
+            except InterruptedError:
+                return
+
+            with self._lock:
+                self.snapshot = new_snapshot
+                self.segments = [name for name in self.segments if name not in immutable]
+                self._write_manifest()
+            for name in immutable + ([snapshot] if snapshot else []):
+                (self.path_dir / name).unlink(missing_ok=True)
+
+# =======================
+# SQLite
+# =======================
+
+class KahSqliteSkipIndex(KahSkipIndexABC):
+    """Index stored in an SQLite table keyed by url: O(log n) lookups, bounded memory, instant startup.
+
+    If path_import (a text index as written by KahMemorySkipIndex) exists, lines not yet imported are
+    imported on open; the imported byte offset is remembered so only new lines are read next time.
+    Marks are buffered in memory and written in one short transaction by a background thread, every
+    commit_every_n adds and every commit_every_ms (and on flush/close). Lookups use their own connection
+    and see marks still buffered or being written.
+
+    The database is in WAL mode and may be shared by several crawler processes (shared=True): readers
+    never block, writers wait on each other for up to busy_timeout_ms (then retry), and marks are
+    committed quickly so they become visible to other processes within ~commit_every_ms."""
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID",
+    )
+    WRITE_RETRIES = 10
+
+    def __init__(self,
+                 path_db: Path,
+                 path_import: Optional[Path] = None,
+                 commit_every_n: Optional[int] = None,
+                 commit_every_ms: Optional[float] = None,
+                 cache_size_kib: int = 16 * 1024,
+                 shared: bool = False,
+                 busy_timeout_ms: int = 5000,
+                 logger: Optional[Logger] = None) -> None:
+        self.path_db = path_db
+        self.logger = logger
+        self.shared = shared
+        if commit_every_n is None:
+            commit_every_n = 16 if shared else 64
+        if commit_every_ms is None:
+            commit_every_ms = 50.0 if shared else 1000.0
+        self.commit_every_n = max(1, commit_every_n)
+        self.commit_every_ms = commit_every_ms
+
+        self.path_db.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock() # guards the in-memory marks only, never held during database calls
+        self._write_lock = threading.RLock() # one writer at a time (committer thread, flush, close, import)
+        self._pending: set[str] = set() # marks not written yet
+        self._inflight: set[str] = set() # marks being written
+        self._closed = threading.Event()
+        self._wake = threading.Event()
+        # autocommit mode: reads never hold a transaction open, writes use explicit BEGIN IMMEDIATE.
+        # Lookups have their own connection, so they never wait on a writer busy-waiting for the database lock.
+        self._conn = self._connect(busy_timeout_ms, cache_size_kib)
+        self._wconn = self._connect(busy_timeout_ms, cache_size_kib)
+        self._write(lambda conn: [conn.execute(statement) for statement in self.SCHEMA])
+
+        if path_import is not None:
+            self.import_text_index(path_import)
+
+        self._committer: Optional[threading.Thread] = None
+        if self.commit_every_ms:
+            self._committer = threading.Thread(target=self._commit_loop, name=f"KahSqliteSkipIndex({self.path_db.name})", daemon=True)
+            self._committer.start()
+
+    def _connect(self, busy_timeout_ms: int, cache_size_kib: int) -> sqlite3.Connection:
+        conn = connect(self.path_db, check_same_thread=False, isolation_level=None, timeout=busy_timeout_ms / 1000.0)
+        conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size=-{int(cache_size_kib)}")
+        return conn
+
+    def _write(self, fn) -> None:
+        """Run fn(conn) in a write transaction, retrying if other processes keep the database locked."""
+        with self._write_lock:
+            for attempt in range(self.WRITE_RETRIES):
+                try:
+                    self._wconn.execute("BEGIN IMMEDIATE")
+                except sqlite3.OperationalError as e:  # busy_timeout elapsed
+                    if "locked" not in str(e) or attempt == self.WRITE_RETRIES - 1:
+                        raise
+                    if self.logger:
+                        self.logger.warning(f"Skip index database at path={self.path_db} is locked, retrying ({attempt + 1}).")
+                    continue
+                try:
+                    fn(self._wconn)
+                    self._wconn.execute("COMMIT")
+                    return
+                except BaseException:
+                    self._wconn.execute("ROLLBACK")
+                    raise
+
+    def __contains__(self, url: str) -> bool:
+        with self._lock:
+            if url in self._pending or url in self._inflight:
+                return True
+        return self._conn.execute("SELECT 1 FROM urls WHERE url = ?", (url,)).fetchone() is not None
+
+    def contains_many(self, urls: Iterable[str]) -> set[str]:
+        urls = list(urls)
+        with self._lock:
+            found = self._pending.intersection(urls)
+            found.update(self._inflight.intersection(urls))
+        found.update(row[0] for row in select_in(self._conn, "SELECT url FROM urls WHERE url IN ({})", urls))
+        return found
+
+    def __iter__(self) -> Iterator[str]:
+        self.flush()
+        rows = self._conn.execute("SELECT url FROM urls ORDER BY url").fetchall()
+        return (row[0] for row in rows)
+
+    def __len__(self) -> int:
+        self.flush()
+        return self._conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def add(self, url: str) -> None:
+        with self._lock:
+            self._pending.add(url)
+            full = len(self._pending) >= self.commit_every_n
+        if full:
+            if self._committer is not None:
+                self._wake.set() # written by the committer thread, the caller never waits on the database
+            else:
+                self.flush()
+
+    def flush(self) -> None:
+        """Write pending marks (blocking)."""
+        with self._write_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._inflight, self._pending = self._pending, set()
+            batch = [(url,) for url in self._inflight]
+            try:
+                self._write(lambda conn: conn.executemany("INSERT OR IGNORE INTO urls (url) VALUES (?)", batch))
+            except BaseException:
+                with self._lock: # keep them for the next attempt
+                    self._pending |= self._inflight
+                    self._inflight = set()
+                raise
+            with self._lock:
+                self._inflight = set()
+
+    def close(self) -> None:
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wake.set()
+        if self._committer is not None:
+            self._committer.join()
+        self.flush()
+        self._conn.close()
+        self._wconn.close()
+
+    def _commit_loop(self) -> None:
+        interval = self.commit_every_ms / 1000.0
+        while not self._closed.is_set():
+            self._wake.wait(interval)
+            self._wake.clear()
+            if self._closed.is_set():
+                return
+            try:
+                self.flush()
+            except sqlite3.Error as e:  # keep pending marks, retry next tick
+                if self.logger:
+                    self.logger.error(f"Failed to commit skip index marks at path={self.path_db}: {e=}")
+
+    # =======================
+    # Import
+    # =======================
+
+    def import_text_index(self, path: Path) -> int:
+        """Import lines of a text index not imported yet. Return the number of lines read."""
+        if not path.exists():
+            return 0
+        key = f"imported_offset:{path.resolve()}"
+        with self._write_lock:
+            row = self._wconn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            offset = int(row[0]) if row else 0
+            size = path.stat().st_size
+            if size < offset:  # file was rewritten (sorted), start over; INSERT OR IGNORE dedupes
+                offset = 0
+            if size == offset:
+                return 0
+            if self.logger:
+                self.logger.info(f"Importing downloaded urls from text index at path={path} (from byte {offset}).")
+
+            count = 0
+            def lines() -> Iterator[tuple[str]]:
+                nonlocal offset, count
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    for raw in f:
+                        if not raw.endswith(b"\n"):
+                            break  # torn write, retry next time
+                        offset += len(raw)
+                        url = raw.rstrip(b"\r\n").decode("utf-8", errors="replace")
+                        if url:
+                            count += 1
+                            yield (url,)
+
+            def import_lines(conn: sqlite3.Connection) -> None:
+                conn.executemany("INSERT OR IGNORE INTO urls (url) VALUES (?)", lines())
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(offset)))
+            self._write(import_lines)
+            if self.logger:
+                self.logger.info(f"Imported {count} urls from text index at path={path}.")
+            return count
+
+# =======================
+# Compact fingerprints
+# =======================
+
+def url_fingerprint(url: str) -> int:
+    """64-bit fingerprint of url (blake2b)."""
+    return int.from_bytes(blake2b(url.encode("utf-8"), digest_size=8).digest(), "little")
+
+class KahBloomFilter:
+    """Bloom filter over 64-bit fingerprints (double hashing on the two 32-bit halves).
+
+    With bits_per_key bits per expected key and k = round(0.69 * bits_per_key) probes, the false
+    positive rate is about 0.6185 ** bits_per_key (0.8% for 10 bits/key) while under capacity."""
+
+    def __init__(self, capacity: int, bits_per_key: int = 10) -> None:
+        self.capacity = max(1024, capacity)
+        self.bits_per_key = bits_per_key
+        self.num_bits = self.capacity * bits_per_key
+        self.num_hashes = max(1, round(0.69 * bits_per_key))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def add(self, fp: int) -> None:
+        bits, m = self.bits, self.num_bits
+        h1, h2 = fp & 0xFFFFFFFF, (fp >> 32) | 1
+        for _ in range(self.num_hashes):
+            pos = h1 % m
+            bits[pos >> 3] |= 1 << (pos & 7)
+            h1 += h2
+        self.count += 1
+
+    def __contains__(self, fp: int) -> bool:
+        bits, m = self.bits, self.num_bits
+        h1, h2 = fp & 0xFFFFFFFF, (fp >> 32) | 1
+        for _ in range(self.num_hashes):
+            pos = h1 % m
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+            h1 += h2
+        return True
+
+    def expected_false_positive_rate(self) -> float:
+        """Theoretical false positive rate at the current fill."""
+        return (1 - exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+class KahFingerprintSkipIndex(KahSkipIndexABC):
+    """Index holding 64-bit url fingerprints in a sorted array('Q') (8 bytes/url) behind a Bloom filter
+    (~1.25 bytes/url), instead of python strings in a set (~150 bytes/url).
+
+    Lookups: Bloom filter (answers most "not seen" cases), then the small set of recent marks, then a
+    binary search in the sorted array. Recent marks are merged into the array once they exceed
+    merge_ratio of its size, so merges are amortized. Two distinct urls share a fingerprint with
+    probability about n**2 / 2**65 over the whole index (~7e-5 at 50M urls); such a collision makes
+    one url wrongly skipped, never downloaded twice.
+
+    Persistence is the same text file as KahMemorySkipIndex (path_index=None keeps it in memory only)."""
+
+    def __init__(self,
+                 path_index: Optional[Path],
+                 flush_every_n: int = 64,
+                 flush_every_ms: Optional[float] = 1000.0,
+                 fsync: bool = False,
+                 bits_per_key: int = 10,
+                 merge_ratio: float = 0.125,
+                 logger: Optional[Logger] = None) -> None:
+        self.path_index = path_index
+        self.bits_per_key = bits_per_key
+        self.merge_ratio = merge_ratio
+        self.logger = logger
+
+        self._sorted = array("Q")
+        self._recent: set[int] = set()
+        self._bloom = KahBloomFilter(0, bits_per_key)
+        self._log: Optional[KahAppendLog] = None
+        if path_index is not None:
+            self.bulk_load(KahAppendLog.read_lines(path_index))
+            if self.logger:
+                self.logger.debug(f"Loaded {len(self)} url fingerprints from index file at path={self.path_index}.")
+            self._log = KahAppendLog(path_index, flush_every_n, flush_every_ms, fsync, logger=logger)
+
+    def bulk_load(self, urls: Iterable[str], chunk_size: int = 1 << 20) -> None:
+        """Add many urls without logging them: sort fingerprints by chunks then merge them once."""
+        runs = [self._sorted]
+        chunk: list[int] = []
+        for url in urls:
+            chunk.append(url_fingerprint(url))
+            if len(chunk) >= chunk_size:
+                chunk.sort()
+                runs.append(array("Q", chunk))
+                chunk = []
+        chunk.extend(self._recent)
+        chunk.sort()
+        runs.append(array("Q", chunk))
+        self._recent = set()
+        self._sorted = self._merge_runs(runs)
+        self._rebuild_bloom()
+
+    @staticmethod
+    def _merge_runs(runs: list[array]) -> array:
+        out = array("Q")
+        last = -1
+        for fp in heapq.merge(*runs):
+            if fp != last:
+                out.append(fp)
+                last = fp
+        return out
+
+    def _rebuild_bloom(self) -> None:
+        self._bloom = KahBloomFilter(int(1.25 * (len(self._sorted) + len(self._recent))), self.bits_per_key)
+        for fp in self._sorted:
+            self._bloom.add(fp)
+        for fp in self._recent:
+            self._bloom.add(fp)
+
+    def _contains_fp(self, fp: int) -> bool:
+        if fp not in self._bloom:
+            return False
+        if fp in self._recent:
+            return True
+        arr = self._sorted
+        i = bisect_left(arr, fp)
+        return i < len(arr) and arr[i] == fp
+
+    def __contains__(self, url: str) -> bool:
+        return self._contains_fp(url_fingerprint(url))
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._recent)
+
+    def __iter__(self) -> Iterator[str]:
+        if self.path_index is None:
+            raise TypeError("In-memory fingerprint index cannot list its urls.")
+        self.flush()
+        return KahAppendLog.read_lines(self.path_index)
+
+    def add(self, url: str) -> None:
+        fp = url_fingerprint(url)
+        if self._contains_fp(fp):
+            return
+        self._recent.add(fp)
+        self._bloom.add(fp)
+        if self._bloom.count > self._bloom.capacity:
+            self._rebuild_bloom()
+        if len(self._recent) > max(4096, self.merge_ratio * len(self._sorted)):
+            self._sorted = self._merge_runs([self._sorted, array("Q", sorted(self._recent))])
+            self._recent = set()
+        if self._log is not None:
+            self._log.append(url)
+
+    def memory_bytes(self) -> int:
+        """Approximate memory used by the index structures."""
+        return (self._sorted.itemsize * len(self._sorted) + len(self._bloom.bits)
+                + sys.getsizeof(self._recent) + 32 * len(self._recent))
+
+    def flush(self) -> None:
+        if self._log is not None:
+            self._log.flush()
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
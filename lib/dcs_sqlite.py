@@ -0,0 +1,63 @@
+"""
+SQLite helpers
+Connection setup (WAL), group commits and chunked IN queries shared by the SQLite-backed indexes.
+"""
+import time
+import sqlite3
+from pathlib import Path
+from logging import Logger
+from typing import Any, Iterable, Iterator, Optional
+
+MAX_VARIABLES = 500 # values per statement, below SQLITE_MAX_VARIABLE_NUMBER (999 before SQLite 3.32)
+
+def connect(path_db: Path, schema: Iterable[str] = (), **kwargs: Any) -> sqlite3.Connection:
+    """Connection to path_db (and its directory, created if needed) in WAL mode with synchronous=NORMAL: commits
+    survive a crash of the process, the last ones may be lost on power loss. Statements of schema are run and
+    committed. kwargs go to sqlite3.connect (default isolation_level: DEFERRED)."""
+    path_db.parent.mkdir(parents=True, exist_ok=True)
+    kwargs.setdefault("isolation_level", "DEFERRED")
+    conn = sqlite3.connect(path_db, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in schema:
+        conn.execute(statement)
+    if conn.in_transaction:
+        conn.commit()
+    return conn
+
+def select_in(conn: sqlite3.Connection, query: str, values: Iterable[Any], chunk_size: int = MAX_VARIABLES) -> Iterator[tuple]:
+    """Rows of query for all values, its "IN ({})" being filled with chunk_size values at a time."""
+    values = list(values)
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i:i + chunk_size]
+        yield from conn.execute(query.format(",".join("?" * len(chunk))), chunk)
+
+class KahSqliteDb:
+    """Base of the SQLite-backed indexes: connection self._conn to path_db with SCHEMA created (see connect).
+    Writes, counted by _wrote(), are committed every commit_every_n writes, every commit_every_ms (checked on
+    write) and on checkpoint()."""
+    SCHEMA: tuple[str, ...] = ()
+
+    def __init__(self, path_db: Path, commit_every_n: int = 256, commit_every_ms: float = 1000.0, logger: Optional[Logger] = None) -> None:
+        self.path_db = path_db
+        self.commit_every_n = commit_every_n
+        self.commit_every_ms = commit_every_ms
+        self.logger = logger
+        self._conn = connect(path_db, self.SCHEMA)
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def _wrote(self) -> None:
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every_n or (time.monotonic() - self._last_commit) * 1000.0 >= self.commit_every_ms:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """Commit pending writes."""
+        self._conn.commit()
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def close(self) -> None:
+        self.checkpoint()
+        self._conn.close()
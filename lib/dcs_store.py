@@ -0,0 +1,141 @@
+"""
+Content-addressed file store
+Identical bytes saved under different names (url variants, CDN aliases, shared jackets) are kept as a single blob,
+logical files being hardlinks to it.
+"""
+import os
+import shutil
+import threading
+from uuid import uuid4
+from hashlib import sha256
+from pathlib import Path
+from logging import Logger
+from typing import Optional
+
+from .dcs_sqlite import connect
+
+class KahBlobWriter:
+    """Temp file being written to the store, hashed as chunks are fed to update()."""
+
+    def __init__(self, tmp_path: Path) -> None:
+        self.tmp_path = tmp_path
+        self.hasher = sha256()
+        self.size = 0
+
+    def update(self, chunk: bytes) -> None:
+        """Account for a chunk written to tmp_path."""
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+    def discard(self) -> None:
+        """Drop the temp file (failed download)."""
+        self.tmp_path.unlink(missing_ok=True)
+
+class KahContentStore:
+    """Store blobs by sha256 under root/blobs/ab/cd/<digest>, logical files being hardlinks to them
+    (copies where hardlinks are unsupported). An index table maps logical names (relative to root
+    when inside it) to digest and size, so "already have it" is a single lookup.
+
+    Usage, hashing while writing:
+        writer = store.new_writer()
+        with open(writer.tmp_path, "wb") as f:
+            f.write(chunk); writer.update(chunk)
+        store.commit(writer, logical_path)"""
+
+    def __init__(self, root: Path, logger: Optional[Logger] = None) -> None:
+        self.root = root
+        self.path_blobs = root / "blobs"
+        self.path_tmp = root / "blobs" / "tmp"
+        self.path_tmp.mkdir(parents=True, exist_ok=True)
+        self.logger = logger
+
+        self._lock = threading.Lock()
+        self._conn = connect(root / "content_index.sqlite3",
+                             ("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL) WITHOUT ROWID",
+                              "CREATE INDEX IF NOT EXISTS files_digest ON files (digest)"),
+                             check_same_thread=False, isolation_level=None, timeout=5.0)
+
+    # =======================
+    # Paths
+    # =======================
+
+    def blob_path(self, digest: str) -> Path:
+        return self.path_blobs / digest[:2] / digest[2:4] / digest
+
+    def name_of(self, path: Path) -> str:
+        """Index key of a logical path."""
+        try:
+            return path.resolve().relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return path.resolve().as_posix()
+
+    # =======================
+    # Lookup
+    # =======================
+
+    def lookup(self, path: Path) -> Optional[tuple[str, int]]:
+        """(digest, size) of a logical file, or None if not stored."""
+        with self._lock:
+            return self._conn.execute("SELECT digest, size FROM files WHERE name = ?", (self.name_of(path),)).fetchone()
+
+    def has_digest(self, digest: str) -> bool:
+        return self.blob_path(digest).exists()
+
+    def __contains__(self, path: Path) -> bool:
+        return self.lookup(path) is not None
+
+    # =======================
+    # Writing
+    # =======================
+
+    def new_writer(self) -> KahBlobWriter:
+        return KahBlobWriter(self.path_tmp / f"{uuid4().hex}.part")
+
+    def commit(self, writer: KahBlobWriter, path: Path) -> tuple[str, bool]:
+        """Move the written temp file into the store and link path to it. Return (digest, deduplicated)."""
+        digest = writer.hasher.hexdigest()
+        blob = self.blob_path(digest)
+        deduplicated = blob.exists()
+        if deduplicated:
+            writer.discard()
+        else:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(writer.tmp_path, blob)
+        self._link(blob, path)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO files (name, digest, size) VALUES (?, ?, ?)", (self.name_of(path), digest, writer.size))
+        if self.logger:
+            self.logger.debug(f"Stored {path} as blob {digest}{' (deduplicated)' if deduplicated else ''}.")
+        return digest, deduplicated
+
+    def put_bytes(self, path: Path, data: bytes) -> tuple[str, bool]:
+        """Store data under logical path. Return (digest, deduplicated)."""
+        writer = self.new_writer()
+        with open(writer.tmp_path, "wb") as f:
+            f.write(data)
+        writer.update(data)
+        return self.commit(writer, path)
+
+    def _link(self, blob: Path, path: Path) -> None:
+        """Atomically make path a hardlink to blob (copy if hardlinks are unsupported)."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid4().hex}.tmp")
+        try:
+            os.link(blob, tmp)
+        except OSError:  # cross-device, FAT, ...
+            shutil.copyfile(blob, tmp)
+        os.replace(tmp, path)
+
+    def rename(self, old_path: Path, new_path: Path) -> None:
+        """Account for a logical file moved from old_path to new_path (outside of the store)."""
+        with self._lock:
+            self._conn.execute("UPDATE files SET name = ? WHERE name = ?", (self.name_of(new_path), self.name_of(old_path)))
+
+    def stats(self) -> tuple[int, int]:
+        """(logical files, distinct blobs)"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*), COUNT(DISTINCT digest) FROM files").fetchone()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
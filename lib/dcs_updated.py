@@ -0,0 +1,28 @@
+"""
+Last-seen updated_at per item
+Incremental crawls only fetch items whose updated_at differs from the one recorded when they were last ingested.
+"""
+import time
+from typing import Optional
+
+from .dcs_sqlite import KahSqliteDb, select_in
+
+class KahUpdatedIndex(KahSqliteDb):
+    """SQLite table key (e.g. product handle) -> updated_at of its last successful ingestion.
+    Timestamps are compared as given (any change counts, whatever the format). Writes are committed every
+    commit_every_n marks, every commit_every_ms and on checkpoint()."""
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS updated (key TEXT PRIMARY KEY, updated_at TEXT NOT NULL, seen REAL NOT NULL) WITHOUT ROWID",)
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT updated_at FROM updated WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def unchanged(self, items: dict[str, str]) -> set[str]:
+        """Keys of items (key -> updated_at) recorded with the same updated_at."""
+        rows = select_in(self._conn, "SELECT key, updated_at FROM updated WHERE key IN ({})", items)
+        return {key for key, updated_at in rows if items[key] == updated_at}
+
+    def mark(self, key: str, updated_at: str) -> None:
+        """Record updated_at of an item once it is ingested."""
+        self._conn.execute("INSERT OR REPLACE INTO updated (key, updated_at, seen) VALUES (?, ?, ?)", (key, updated_at, time.time()))
+        self._wrote()
@@ -0,0 +1,122 @@
+"""
+URL canonicalization
+Equivalent urls (scheme-relative, CDN host aliases, cache-busting query parameters, ...) are mapped to a
+single canonical form, used both as skip index key and as the url actually fetched.
+"""
+import re
+from functools import lru_cache
+from typing import Iterable, Optional
+from urllib.parse import urlsplit, urlunsplit, unquote_plus, urlencode, quote
+
+UNRESERVED = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+PATH_SAFE = "/%:@!$&'()*+,;=-._~" # kept as is by normalize_escapes, on top of unreserved characters
+QUERY_SAFE = PATH_SAFE + "?"
+RE_ESCAPE = re.compile(r"%([0-9A-Fa-f]{2})")
+RE_LONE_PERCENT = re.compile(r"%(?![0-9A-Fa-f]{2})")
+
+def normalize_escapes(part: str, safe: str = PATH_SAFE) -> str:
+    """Single percent-encoding of a path (or query): non-ASCII and unsafe characters escaped (utf-8), escapes of
+    unreserved characters decoded, the others uppercased (as yarl/aiohttp send it). Reserved escapes (e.g. %2F)
+    are kept."""
+    part = quote(RE_LONE_PERCENT.sub("%25", part), safe=safe)
+    return RE_ESCAPE.sub(lambda m: chr(int(m[1], 16)) if chr(int(m[1], 16)) in UNRESERVED else f"%{m[1].upper()}", part)
+
+class KahUrlRule:
+    """Canonicalization rule for a host and its subdomains.
+
+    query_allow: if set, only keep these query parameters
+    query_deny: drop these query parameters (e.g. Shopify CDN cache-busting "v")
+    query_set: force these query parameters (e.g. Melonbooks {"adult_view": "1"})
+    sort_query: sort query parameters by name
+    keep_fragment: keep the #fragment
+
+    Without query_allow, query_deny or query_set, queries are left untouched. Otherwise kept parameters are kept
+    as written (not re-encoded)."""
+
+    def __init__(self,
+                 query_allow: Optional[Iterable[str]] = None,
+                 query_deny: Iterable[str] = (),
+                 query_set: Optional[dict[str, str]] = None,
+                 sort_query: bool = True,
+                 keep_fragment: bool = False) -> None:
+        self.query_allow = frozenset(query_allow) if query_allow is not None else None
+        self.query_deny = frozenset(query_deny)
+        self.query_set = dict(query_set or {})
+        self.sort_query = sort_query
+        self.keep_fragment = keep_fragment
+        self.filters_query = self.query_allow is not None or bool(self.query_deny) or bool(self.query_set)
+
+    def apply_query(self, query: str) -> str:
+        if not self.filters_query:
+            return query
+        params = []
+        for param in filter(None, query.split("&")): # empty pieces (e.g. "a=1&&b=2") dropped
+            key = unquote_plus(param.partition("=")[0])
+            if key not in self.query_deny and (self.query_allow is None or key in self.query_allow) and key not in self.query_set:
+                params.append((key, param))
+        params.extend((k, urlencode({k: v})) for k, v in self.query_set.items())
+        if self.sort_query:
+            params.sort(key=lambda p: p[0]) # stable: repeated parameters keep their order
+        return "&".join(param for _, param in params)
+
+class KahUrlCanonicalizer:
+    """Map urls to a canonical form: lowercase scheme and host, https for scheme-relative urls,
+    host aliases resolved, default port and fragment dropped, path and query percent-encoded once (see
+    normalize_escapes), query filtered and sorted per host rule (if any).
+
+    Example (Melonbooks):
+        KahUrlCanonicalizer(
+            rules={"melonbooks.co.jp": KahUrlRule(query_set={"adult_view": "1"})},
+            host_aliases={"melonbooks.akamaized.net": "www.melonbooks.co.jp"})
+
+    Raw and encoded urls (e.g. as received from aiohttp) are the same url:
+        canonicalize("https://shop.akbh.jp/products/あ-cd.js") == canonicalize("https://shop.akbh.jp/products/%e3%81%82-cd.js")
+            == "https://shop.akbh.jp/products/%E3%81%82-cd.js"
+
+    Results are memoized (memo_size urls), as are host rule lookups."""
+    DEFAULT_PORTS = {"http": 80, "https": 443}
+
+    def __init__(self,
+                 rules: Optional[dict[str, KahUrlRule]] = None,
+                 host_aliases: Optional[dict[str, str]] = None,
+                 default_rule: Optional[KahUrlRule] = None,
+                 default_scheme: str = "https",
+                 memo_size: int = 1 << 16) -> None:
+        self.rules = {host.lower(): rule for host, rule in (rules or {}).items()}
+        self.host_aliases = {alias.lower(): host.lower() for alias, host in (host_aliases or {}).items()}
+        self.default_rule = default_rule or KahUrlRule()
+        self.default_scheme = default_scheme
+        self.canonicalize = lru_cache(maxsize=memo_size)(self._canonicalize)
+        self._rule_for_host = lru_cache(maxsize=1024)(self._find_rule)
+
+    def __call__(self, url: str) -> str:
+        return self.canonicalize(url)
+
+    def _find_rule(self, host: str) -> KahUrlRule:
+        while host:
+            rule = self.rules.get(host)
+            if rule is not None:
+                return rule
+            _, _, host = host.partition(".")
+        return self.default_rule
+
+    def _canonicalize(self, url: str) -> str:
+        url = url.strip()
+        if url.startswith("//"):
+            url = f"{self.default_scheme}:{url}"
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return url
+        if not parts.hostname:
+            return url
+        scheme = parts.scheme.lower()
+        host = parts.hostname  # lowercased by urlsplit
+        host = self.host_aliases.get(host, host)
+        netloc = host if port is None or port == self.DEFAULT_PORTS.get(scheme) else f"{host}:{port}"
+        if parts.username or parts.password:
+            netloc = f"{parts.netloc.rpartition('@')[0]}@{netloc}"
+        rule = self._rule_for_host(host)
+        query = rule.apply_query(normalize_escapes(parts.query, QUERY_SAFE))
+        return urlunsplit((scheme, netloc, normalize_escapes(parts.path) or "/", query, parts.fragment if rule.keep_fragment else ""))
@@ -0,0 +1,45 @@
+"""
+Convert flat file directories (e.g. Resources/<crawler>/images, old ItemImages/ItemPages folders) into sharded
+directories with a manifest (see lib/dcs_shard.py).
+
+Usage: python migrate_shards.py <flat_dir> [--to <sharded_dir>] [--pattern "*.html"] [--store <content_store_root>]
+Without --to, the directory is sharded in place. Files are moved (renamed), so both directories must be on the same
+filesystem. If the files are hardlinks of a content store (SHOULD_DEDUPE_IMAGES), pass its root with --store to keep
+its index in sync. Interrupted migrations can be rerun.
+"""
+import sys
+import logging
+import argparse
+from pathlib import Path
+from lib.dcs_shard import KahShardedDir
+from lib.dcs_store import KahContentStore
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Shard a flat file directory.")
+    parser.add_argument("flat_dir", type=Path)
+    parser.add_argument("--to", type=Path, default=None, help="sharded directory (default: flat_dir itself)")
+    parser.add_argument("--pattern", default="*", help="only move files matching this glob pattern")
+    parser.add_argument("--depth", type=int, default=1, help="shard levels")
+    parser.add_argument("--width", type=int, default=2, help="hex characters per shard level")
+    parser.add_argument("--store", type=Path, default=None, help="root of the content store the files are linked to")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger("migrate_shards")
+    if not args.flat_dir.is_dir():
+        logger.error(f"Not a directory: {args.flat_dir}")
+        return 1
+
+    shards = KahShardedDir(args.to or args.flat_dir, depth=args.depth, width=args.width, logger=logger)
+    store = KahContentStore(args.store, logger=logger) if args.store else None
+    try:
+        shards.import_flat(args.flat_dir, args.pattern, on_move=store.rename if store else None)
+        logger.info(f"{len(shards)} files in {shards.root}.")
+    finally:
+        shards.close()
+        if store:
+            store.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
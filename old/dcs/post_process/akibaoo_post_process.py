@@ -11,10 +11,12 @@ Just run this script with python. e.g. `python akibaoo_post_process.py`
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent)) # Allow relative import
+sys.path.append(str(Path(__file__).parents[3])) # Allow import of the repository lib
 
 import re
 from typing import Optional, Literal
-from bs4 import BeautifulSoup
+from lxml import etree
+from lib.dcs_extract import KahExtractor, KahField, text_of
 from db_wrapper import DBWrapper, DBColumnDescription
 from dataclasses import dataclass
 from spiders.akibaoo_settings import RESOURCES_FOLDER_PATH, ITEM_HTML_FOLDER_PATH, ITEM_IMAGE_FOLDER_PATH, get_id_and_image_file_name_from_url
@@ -50,69 +52,55 @@ class AkibaooColumnDescription(DBColumnDescription):
     def get_primary_key(self) -> str:
         return "item_id"
 
-class AkibaooSoupParser:
-    """Wraps parsing of Akibaoo product page soup."""
+SITE_TITLE_SUFFIX = " | あきばお～こく"
 
-    def __init__(self, soup: BeautifulSoup):
-        self.soup = soup
-        # self.soup_raw = soup.prettify(encoding="utf-8")
+class AkibaooPageParser:
+    """Wraps parsing of Akibaoo product pages. Fields are compiled once to XPath (see KahExtractor)."""
+    EXTRACTOR = KahExtractor({
+        "canonical": KahField('link[rel="canonical"]', "@href"),
+        "name": KahField("title", transform=lambda title: title.replace(SITE_TITLE_SUFFIX, "").strip(" \n")),
+        "area_detail": KahField("div.area_Detail", "element"),
+        "info_details": KahField("div#goodsDetail_info.goodsDetail_info.cf", "html"),
+        "image_urls": KahField("img.goodsDtlImgThumb", "@src", many=True),
+    })
+
+    def __init__(self, page: bytes | str):
+        self.fields = self.EXTRACTOR.extract(page)
 
         self.url, self.item_id = self._get_item_url_and_id()
-        self.name = self._get_name()
+        self.name = self.fields["name"]
         self.area_details = self._get_area_details()
-        self.info_details = self._get_info_details()
+        self.info_details = self.fields["info_details"]
 
         self.image_urls, self.image_file_paths = self._get_image_urls_and_paths()
 
     def _get_item_url_and_id(self) -> tuple[str | None, str | None] : # Retrieve url and item id
-        link = self.soup.select_one('link[rel="canonical"]')
-        if not link or 'href' not in link.attrs:
+        href = self.fields["canonical"]
+        if not href:
             return None, None
-        url = f"www.akibaoo.com{link['href']}"
-        m = re.search(r"\/([^\/]+)\/?$", str(link['href']), re.IGNORECASE)
+        url = f"www.akibaoo.com{href}"
+        m = re.search(r"\/([^\/]+)\/?$", href, re.IGNORECASE)
         if not m:
             return url, None
         return url, m.group(1)
-    
-    def _get_name(self) -> str | None: # Retrieve name
-        title = self.soup.select_one('title')
-        if not title:
-            return None
-        
-        return title.text.replace(" | あきばお～こく", "").strip(" \n")
 
     def _get_area_details(self) -> str | None: # Retrieve content of <div class="area_Detail">
-        tag = self.soup.select_one('div.area_Detail')
-        if not tag:
+        tag: Optional[etree._Element] = self.fields["area_detail"]
+        if tag is None:
             return None
-        
+
         detail_dict_lists: dict[str, list[str]] = {}
-        for element in tag.find_all(True):
-            if element.has_attr('class'):
-                class_name = ' '.join(element['class'])
-                text_content = element.get_text(strip=True)
+        for element in tag.iterdescendants(etree.Element):
+            if element.get("class") is not None:
+                class_name = " ".join(element.get("class").split())
+                text_content = text_of(element)
                 if text_content:
-                    if class_name not in detail_dict_lists:
-                        detail_dict_lists[class_name] = [text_content]
-                    else:
-                        detail_dict_lists[class_name].append(text_content)
-        detail_dict: dict[str,str] = {}
-        for cn in detail_dict_lists:
-            detail_dict[cn] = "\n".join(detail_dict_lists[cn])
+                    detail_dict_lists.setdefault(class_name, []).append(text_content)
+        detail_dict = {cn: "\n".join(texts) for cn, texts in detail_dict_lists.items()}
         return json.dumps(detail_dict, ensure_ascii=False, indent=None)
 
-    def _get_info_details(self) -> str | None: # Retrieve <p class="detail_info"> info
-        goods_detail_div = soup.select_one('div#goodsDetail_info.goodsDetail_info.cf')
-
-        if goods_detail_div:
-            return str(goods_detail_div)
-        return None
-
     def _get_image_urls_and_paths(self) -> tuple[str | None, str | None]: # Retrieve image urls and expected paths. Format is (", ".join(image_urls), ", ".join(image_paths))
-        img_tags = self.soup.select('img.goodsDtlImgThumb')
-        if not img_tags:
-            return None, None
-        image_urls = [img["src"] for img in img_tags]
+        image_urls: list[str] = self.fields["image_urls"]
         if not image_urls:
             return None, None
         
@@ -154,12 +142,7 @@ if __name__ == "__main__":
     # === Process html dumps ===
     for html_file_path in ITEM_HTML_FOLDER_PATH.rglob('*.html'):
         try:
-            soup: BeautifulSoup
-            # Open file
-            with open(html_file_path, "r", encoding="utf-8") as f:
-                soup = BeautifulSoup(f, features="html.parser")
-        
-            parsed = AkibaooSoupParser(soup)
+            parsed = AkibaooPageParser(html_file_path.read_bytes())
             new_item = AkibaooColumnDescription(
                 item_id=parsed.item_id,
                 url=parsed.url,
@@ -33,9 +33,8 @@ def configure_loggers(): # Called when starting the spider, configure the logger
 # root url list definition
 #   Here, define the first pages to parse, from which new pages can be accessed. For example, a search pages for all M3-XX events.
 # ===================================================================
-akibaoo_urls: list[str] = [] # /!\ Should be updated if there are more pages !
-for i in range(1,61): # Manually adding all search pages for doujin music because there is no "next page" button easily accessible
-    akibaoo_urls.append(f"https://www.akibaoo.com/c/82/?page={i}") # Category for Doujin Music
+AKIBAOO_SEARCH_URL = "https://www.akibaoo.com/c/82/?page={page}" # Category for Doujin Music; no "next page" button easily accessible
+AKIBAOO_SEARCH_WINDOW = 4 # search pages requested ahead, until an empty (or repeated) page is found
 
 # ======================================================================
 # Utilities
@@ -6,7 +6,7 @@ import scrapy
 import scrapy.http
 import scrapy.http.response
 import scrapy.responsetypes
-from .akibaoo_settings import configure_loggers, LOG_SEARCH_PATH, LOG_ITEMS_PATH, ITEM_HTML_FOLDER_PATH, akibaoo_urls, get_id_and_image_file_name_from_url
+from .akibaoo_settings import configure_loggers, LOG_SEARCH_PATH, LOG_ITEMS_PATH, ITEM_HTML_FOLDER_PATH, AKIBAOO_SEARCH_URL, AKIBAOO_SEARCH_WINDOW, get_id_and_image_file_name_from_url
 from .common import file_path_substitution
 
 import re
@@ -26,22 +26,36 @@ class AkibaooSpider(scrapy.Spider):
         # ==== Configure loggers ====
         configure_loggers()
         super().__init__(*args, **kwargs)
+        self.search_end_page = None # first empty (or repeated) search page, once seen
+        self.search_pages_seen = {} # items of a search page -> page
+        self.search_next_page = 1 # highest search page requested + 1
+
+    def _search_request(self, page: int) -> scrapy.Request:
+        return scrapy.Request(url=AKIBAOO_SEARCH_URL.format(page=page), callback=self.parse_search_for_products, errback=self.handle_error, cb_kwargs={"page": page})
+
+    def _fill_search(self, up_to: int):
+        """Request the search pages not requested yet below up_to (and below the end page, once seen)."""
+        if self.search_end_page is not None:
+            up_to = min(up_to, self.search_end_page)
+        while self.search_next_page < up_to:
+            yield self._search_request(self.search_next_page)
+            self.search_next_page += 1
 
     async def start(self):
-        global akibaoo_urls # schedule all root urls
-        for url in akibaoo_urls:
-            yield scrapy.Request(url=url, callback=self.parse_search_for_products, errback=self.handle_error)
+        for request in self._fill_search(1 + AKIBAOO_SEARCH_WINDOW): # schedule the first search pages, next ones are requested as pages come
+            yield request
         
-    def parse_search_for_products(self, response: scrapy.http.TextResponse):
+    def parse_search_for_products(self, response: scrapy.http.TextResponse, page: int = None):
         """Parse search pages.
 
         Yields new requests for:
-            * New search pages (next page) -> self.parse_search_for_products(...)
+            * New search pages (up to AKIBAOO_SEARCH_WINDOW pages ahead of this one, until an empty or repeated page) -> self.parse_search_for_products(...)
             * Corresponding item pages -> self.parse_product(...)"""
         if not response:
             return
-        if response.status != 200:
+        if response.status != 200: # not an empty page: does not end the search, later pages refill the window
             self.handle_error(f"Error: {response.status}...")
+            return
 
         with open(LOG_SEARCH_PATH, "a+", encoding="utf-8") as f: # Log
             self.counter_search+=1
@@ -50,13 +64,22 @@ class AkibaooSpider(scrapy.Spider):
         # === Crawl to product pages ===
         item_urls = response.xpath('//div[contains(@class, "set-group goodsInfo")]//a/@href').getall()
 
+        # === Crawl for more search pages === -> No easy next page button, request pages ahead until an empty or repeated one
+        if page is not None:
+            if self.search_end_page is not None and page >= self.search_end_page:
+                return
+            first_page = self.search_pages_seen.setdefault(frozenset(item_urls), page)
+            if not item_urls or first_page != page:
+                self.search_end_page = page
+                self.logger.info(f"End of search pages at page {page}.")
+                return
+            yield from self._fill_search(page + 1 + AKIBAOO_SEARCH_WINDOW)
+
         if item_urls:
             for item_url in item_urls:
                 full_item_url = self._get_product_url(response, item_url)
                 yield scrapy.Request(full_item_url, callback=self.parse_product, errback=self.handle_error)
         
-        # === Crawl for more next search page === -> No easy next page button...
-        
     def parse_product(self, response: scrapy.http.TextResponse):
         """Parse product pages for metatada"""
         if not response: